@@ -0,0 +1,253 @@
+# Tailor one saved profile to many job postings without the GUI. Extraction and
+# Gemini generation run as a pipeline on two bounded thread pools, so the
+# extraction for the next postings overlaps the generation for earlier ones.
+#
+#   python Batch_tailor.py postings.jsonl --profile user_profile.json --output-dir tailored
+#
+# postings.jsonl holds job_title, company and description (or job_description)
+# on every line. Each posting gets its own directory with generated_resume.tex,
+# cover_letter.txt and extraction.json; summary.json reports per-stage latency
+# and throughput. Postings whose directory already holds both outputs are
+# skipped, so re-running after a failure only redoes what is missing.
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from Main import (PROFILE_RANKING, ExtractorError, ResumeGenerationWorker, ResumeOutputSplitter,
+                  extract_required_skills, format_resume_prompt, stream_gemini)
+from Profile_ranker import rank_profile
+
+# Concurrent extraction requests; the server batches the ones that arrive together
+BATCH_EXTRACT_WORKERS = int(os.getenv('BATCH_EXTRACT_WORKERS', '4'))
+# Concurrent Gemini generations; keep this within the API key's rate limit
+BATCH_GENERATE_WORKERS = int(os.getenv('BATCH_GENERATE_WORKERS', '4'))
+
+RESUME_FILE = "generated_resume.tex"
+COVER_LETTER_FILE = "cover_letter.txt"
+
+
+def load_postings(path):
+    postings = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            description = str(record.get('description') or record.get('job_description') or '')
+            if not description.strip():
+                raise ValueError(f"{path}:{line_number} needs a description")
+            postings.append({
+                'job_title': str(record.get('job_title') or ''),
+                'company': str(record.get('company') or ''),
+                'description': description,
+            })
+    return postings
+
+
+def load_prompt_template():
+    try:
+        with open("prompt_template.txt", "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ResumeGenerationWorker.get_default_prompt()
+
+
+def job_directory(output_dir, index, posting):
+    """Stable per-posting directory name, e.g. 0007-acme-data-engineer"""
+    slug = re.sub(r"[^a-z0-9]+", "-", f"{posting['company']} {posting['job_title']}".lower()).strip("-")
+    return os.path.join(output_dir, f"{index:04d}-{slug[:60] or 'posting'}")
+
+
+def is_done(directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in (RESUME_FILE, COVER_LETTER_FILE))
+
+
+def timed(function, *args):
+    """Run function in a pool thread, returning (result, started, finished) so queueing is not counted"""
+    started = time.perf_counter()
+    result = function(*args)
+    return result, started, time.perf_counter()
+
+
+def extract(posting):
+    required_skills = extract_required_skills(posting)
+    if required_skills == "Skills extraction failed":
+        # Not worth a Gemini call without requirements to tailor against
+        raise ExtractorError("the extraction server returned no result")
+    return required_skills
+
+
+def generate(formatted_prompt, directory):
+    splitter = ResumeOutputSplitter(
+        resume_path=os.path.join(directory, RESUME_FILE),
+        cover_letter_path=os.path.join(directory, COVER_LETTER_FILE),
+    )
+    _, stats = stream_gemini(formatted_prompt, splitter.feed)
+    splitter.close()
+    return stats
+
+
+def prepare_generation(job, posting, required_skills, profile, profile_path, template):
+    """Rank the profile for one posting and build its Gemini prompt; runs on the coordinating thread"""
+    user_profile = profile
+    report = None
+    if PROFILE_RANKING:
+        user_profile, report = rank_profile(profile, required_skills, profile_path=profile_path)
+        job["profile_tokens"] = report["profile_tokens_after"]
+
+    with open(os.path.join(job["directory"], "extraction.json"), 'w', encoding='utf-8') as f:
+        json.dump({"job": posting, "required_skills": required_skills, "ranking": report}, f, indent=2)
+
+    return format_resume_prompt(template, {
+        "user_profile": user_profile,
+        "job_requirements": {
+            "job_title": posting['job_title'],
+            "company": posting['company'],
+            "required_skills": required_skills,
+        },
+    })
+
+
+def run_batch(postings, profile, profile_path, template, output_dir,
+              extract_workers=BATCH_EXTRACT_WORKERS, generate_workers=BATCH_GENERATE_WORKERS, force=False):
+    """Run every posting through extraction then generation; returns one timing record per posting"""
+    jobs = []
+    pending = {}
+    extract_pool = ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="batch-extract")
+    generate_pool = ThreadPoolExecutor(max_workers=generate_workers, thread_name_prefix="batch-generate")
+    try:
+        for index, posting in enumerate(postings):
+            directory = job_directory(output_dir, index, posting)
+            job = {"index": index, "job_title": posting['job_title'], "company": posting['company'],
+                   "directory": directory, "status": "pending"}
+            jobs.append(job)
+            if not force and is_done(directory):
+                job["status"] = "skipped"
+                continue
+            os.makedirs(directory, exist_ok=True)
+            job["submitted"] = time.perf_counter()
+            pending[extract_pool.submit(timed, extract, posting)] = ("extract", job)
+
+        queued = len(pending)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, job = pending.pop(future)
+                try:
+                    result, started, finished = future.result()
+                except Exception as e:
+                    job["status"] = "failed"
+                    job["error"] = f"{stage}: {e}"
+                    print(f"❌ {job['directory']}: {job['error']}")
+                    continue
+
+                if stage == "extract":
+                    job["extract_wait_seconds"] = started - job["submitted"]
+                    job["extract_seconds"] = finished - started
+                    job["extracted"] = finished
+                    try:
+                        formatted_prompt = prepare_generation(
+                            job, postings[job["index"]], result, profile, profile_path, template
+                        )
+                    except Exception as e:
+                        job["status"] = "failed"
+                        job["error"] = f"prepare: {e}"
+                        print(f"❌ {job['directory']}: {job['error']}")
+                        continue
+                    pending[generate_pool.submit(timed, generate, formatted_prompt, job["directory"])] = ("generate", job)
+                else:
+                    job["generate_wait_seconds"] = started - job["extracted"]
+                    job["generate_seconds"] = finished - started
+                    job["first_chunk_seconds"] = result["first_chunk_seconds"]
+                    job["prompt_tokens"] = result["prompt_tokens"]
+                    job["end_to_end_seconds"] = finished - job["submitted"]
+                    job["status"] = "ok"
+                    completed = sum(1 for j in jobs if j["status"] == "ok")
+                    print(f"[{completed}/{queued}] {job['directory']} "
+                          f"(extract {job['extract_seconds']:.1f}s, generate {job['generate_seconds']:.1f}s)")
+    except KeyboardInterrupt:
+        print("Interrupted, cancelling queued postings (finished ones are kept)...")
+        for future in pending:
+            future.cancel()
+    finally:
+        extract_pool.shutdown(wait=True, cancel_futures=True)
+        generate_pool.shutdown(wait=True, cancel_futures=True)
+
+    for job in jobs:
+        # Absolute clock readings only mattered while running
+        job.pop("submitted", None)
+        job.pop("extracted", None)
+    return jobs
+
+
+def latency_stats(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean_s": sum(values) / len(values),
+        "p50_s": values[len(values) // 2],
+        "p95_s": values[min(int(len(values) * 0.95), len(values) - 1)],
+        "max_s": values[-1],
+    }
+
+
+def summarize(jobs, wall_seconds):
+    completed = [job for job in jobs if job["status"] == "ok"]
+    stages = {}
+    for stage in ("extract_wait", "extract", "generate_wait", "generate", "first_chunk", "end_to_end"):
+        stages[stage] = latency_stats(job.get(f"{stage}_seconds") for job in jobs)
+    busy = sum(job.get("extract_seconds", 0) + job.get("generate_seconds", 0) for job in jobs)
+    return {
+        "postings": len(jobs),
+        "completed": len(completed),
+        "failed": sum(1 for job in jobs if job["status"] == "failed"),
+        "skipped": sum(1 for job in jobs if job["status"] == "skipped"),
+        "wall_seconds": wall_seconds,
+        "postings_per_minute": len(completed) / wall_seconds * 60 if wall_seconds else 0.0,
+        # Summed stage time over wall time: above 1 means stages and postings overlapped
+        "concurrency": busy / wall_seconds if wall_seconds else 0.0,
+        "stages": stages,
+        "jobs": jobs,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tailor a resume and cover letter to every posting in a JSONL file")
+    parser.add_argument("postings", help="JSONL file with job_title, company and description on every line")
+    parser.add_argument("--profile", default="user_profile.json", help="Profile saved by the desktop app")
+    parser.add_argument("--output-dir", default="tailored", help="Directory for the per-posting output directories")
+    parser.add_argument("--extract-workers", type=int, default=BATCH_EXTRACT_WORKERS,
+                        help=f"Concurrent extraction requests (default: {BATCH_EXTRACT_WORKERS})")
+    parser.add_argument("--generate-workers", type=int, default=BATCH_GENERATE_WORKERS,
+                        help=f"Concurrent Gemini generations (default: {BATCH_GENERATE_WORKERS})")
+    parser.add_argument("--force", action="store_true", help="Regenerate postings that already have outputs")
+    args = parser.parse_args()
+
+    with open(args.profile, 'r', encoding='utf-8') as f:
+        profile = json.load(f)
+    postings = load_postings(args.postings)
+    template = load_prompt_template()
+    print(f"Tailoring {args.profile} to {len(postings)} postings "
+          f"({args.extract_workers} extraction / {args.generate_workers} generation workers)")
+
+    start = time.perf_counter()
+    jobs = run_batch(postings, profile, args.profile, template, args.output_dir,
+                     args.extract_workers, args.generate_workers, args.force)
+    summary = summarize(jobs, time.perf_counter() - start)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_path = os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"{summary['completed']} tailored, {summary['failed']} failed, {summary['skipped']} skipped "
+          f"in {summary['wall_seconds']:.1f}s ({summary['postings_per_minute']:.1f} postings/min)")
+    for stage, stats in summary["stages"].items():
+        if stats is not None:
+            print(f"  {stage:<14} p50 {stats['p50_s']:.2f}s  p95 {stats['p95_s']:.2f}s  mean {stats['mean_s']:.2f}s")
+    print(f"Summary written to {summary_path}")
@@ -0,0 +1,259 @@
+# Compare fine-tuned checkpoints on a held-out set: JSON validity and per-key F1
+# against the expected extraction, plus latency and generated tokens at several
+# batch sizes, using the same prompt and decoding settings as Mistral_server.
+# Quality is scored with each checkpoint as an unmerged adapter; latency is
+# timed with it merged into the base weights, as the server runs by default.
+#
+#   python Evaluate.py heldout.jsonl ./mistral-job-extractor/checkpoint-100 ./mistral-job-extractor/checkpoint-200
+#
+# heldout.jsonl holds job_title, company, job_description and expected (the
+# reference extraction object) on every line.
+import os
+
+# Checkpoints are swapped in as adapters on one unmerged base model, and only
+# merged into it while their latency is timed
+os.environ.setdefault("EXTRACT_MULTI_ADAPTER", "1")
+
+import argparse
+import json
+import re
+import time
+from contextlib import contextmanager
+
+import Mistral_server as server
+
+logger = server.logger
+
+DEFAULT_BATCH_SIZES = "1,4,16"
+
+
+def load_heldout(path):
+    postings = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record.get('expected'), dict) or not str(record.get('job_description', '')).strip():
+                raise ValueError(f"{path}:{line_number} needs a job_description and an expected object")
+            postings.append(record)
+    return postings
+
+
+def value_items(value):
+    """Normalize an extracted value into a set of comparable items ("N/A" is empty)"""
+    if isinstance(value, dict):
+        value = [f"{k}: {v}" for k, v in value.items()]
+    if not isinstance(value, list):
+        value = re.split(r"[,;\n]|\band\b", str(value or ""))
+    items = {" ".join(str(item).lower().strip(" .-*•").split()) for item in value}
+    return {item for item in items if item and item != "n/a"}
+
+
+def f1_score(predicted, expected):
+    if not predicted and not expected:
+        return 1.0
+    overlap = len(predicted & expected)
+    if not overlap:
+        return 0.0
+    precision = overlap / len(predicted)
+    recall = overlap / len(expected)
+    return 2 * precision * recall / (precision + recall)
+
+
+def extract(postings, adapter):
+    """Run one batch of postings through the server's prompt and generation path.
+
+    Returns (responses, prompts); map-reduced postings are merged the same way
+    the server does it.
+    """
+    prepared = [
+        server.prepare_prompts(str(p.get('job_title', '')), str(p.get('company', '')), str(p['job_description']))
+        for p in postings
+    ]
+    flat = []
+    for prompt, chunk_prompts in prepared:
+        flat.extend(chunk_prompts or [prompt])
+    outputs = [server.trim_response(prompt, output) for prompt, output in zip(flat, server.generate_texts(flat, adapter=adapter))]
+
+    responses = []
+    position = 0
+    for prompt, chunk_prompts in prepared:
+        if chunk_prompts is None:
+            responses.append(outputs[position])
+            position += 1
+            continue
+        chunk_outputs = outputs[position:position + len(chunk_prompts)]
+        position += len(chunk_prompts)
+        results = [server.parse_extraction(p, o) for p, o in zip(chunk_prompts, chunk_outputs)]
+        merged = server.merge_extractions([result for result in results if result is not None])
+        responses.append(prompt + json.dumps(merged, indent=2))
+    return responses, [prompt for prompt, _ in prepared]
+
+
+def score(postings, responses, prompts):
+    """JSON validity rate, mean F1 per key and mean F1 overall"""
+    valid = 0
+    key_scores = {key: 0.0 for key in server.EXTRACTION_KEYS}
+    for posting, response, prompt in zip(postings, responses, prompts):
+        parsed = server.parse_extraction(prompt, response)
+        if parsed is not None and all(key in parsed for key in server.EXTRACTION_KEYS):
+            valid += 1
+        parsed = parsed or {}
+        for key in server.EXTRACTION_KEYS:
+            key_scores[key] += f1_score(value_items(parsed.get(key)), value_items(posting['expected'].get(key)))
+    count = len(postings)
+    per_key = {key: total / count for key, total in key_scores.items()}
+    return {
+        "json_valid": valid / count,
+        "f1": per_key,
+        "mean_f1": sum(per_key.values()) / len(per_key),
+    }
+
+
+def measure(postings, adapter, batch_size):
+    """Time the held-out set at one batch size; every posting waits for its whole batch"""
+    tokenizer = server.generator.tokenizer
+    responses = []
+    prompts = []
+    latencies = []
+    generated = 0
+    total = 0.0
+    for start in range(0, len(postings), batch_size):
+        batch = postings[start:start + batch_size]
+        begin = time.perf_counter()
+        batch_responses, batch_prompts = extract(batch, adapter)
+        elapsed = time.perf_counter() - begin
+        total += elapsed
+        latencies.extend([elapsed] * len(batch))
+        responses.extend(batch_responses)
+        prompts.extend(batch_prompts)
+        for prompt, response in zip(batch_prompts, batch_responses):
+            completion = response[len(prompt):] if response.startswith(prompt) else response
+            generated += len(tokenizer(completion, add_special_tokens=False).input_ids)
+
+    latencies.sort()
+    return responses, prompts, {
+        "batch_size": batch_size,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        # Wall time per posting, i.e. what a full queue of postings costs
+        "ms_per_posting": total / len(postings) * 1000,
+        "generated_tokens_per_posting": generated / len(postings),
+        "tokens_per_sec": generated / total if total else 0.0,
+    }
+
+
+@contextmanager
+def resident(index, path):
+    """Yield the adapter name of a checkpoint, loading it for the duration if it is not the default"""
+    if os.path.abspath(path) == os.path.abspath(server.LORA_MODEL_PATH):
+        yield server.DEFAULT_ADAPTER
+        return
+    # Only one extra checkpoint is resident at a time
+    name = f"eval{index}"
+    server.adapter_registry.load(name, path)
+    try:
+        yield name
+    finally:
+        server.adapter_registry.unload(name)
+
+
+@contextmanager
+def merged(name):
+    """Merge an adapter into the base weights, as the server's default mode serves it, then unmerge it"""
+    registry = server.adapter_registry
+    with registry.lock:
+        registry.model.merge_adapter(adapter_names=[name])
+    try:
+        yield
+    finally:
+        with registry.lock:
+            registry.model.unmerge_adapter()
+
+
+def score_checkpoint(name, postings, batch_size):
+    """Quality of an unmerged adapter, so rounding from merging into 4-bit weights never carries over"""
+    logger.info(f"Scoring {name}...")
+    # Padding can change greedy outputs slightly, so quality comes from the first batch size
+    responses, prompts, _ = measure(postings, name, batch_size)
+    return score(postings, responses, prompts)
+
+
+def time_checkpoint(name, postings, batch_sizes):
+    """Latency at every batch size with the adapter merged in"""
+    logger.info(f"Timing {name}...")
+    latencies = []
+    with merged(name):
+        # Warm up so CUDA kernel selection is not timed
+        extract(postings[:1], name)
+        for batch_size in batch_sizes:
+            _, _, latency = measure(postings, name, batch_size)
+            latencies.append(latency)
+            logger.info(f"{name} @ batch {batch_size}: p50 {latency['p50_ms']:.0f} ms, {latency['ms_per_posting']:.0f} ms/posting")
+    return latencies
+
+
+def format_table(results, batch_sizes):
+    headers = ["checkpoint", "valid JSON", "mean F1", "skills F1"]
+    headers += [f"ms/posting @{batch_size}" for batch_size in batch_sizes]
+    headers += ["tokens/posting", "F1 per second"]
+    rows = []
+    for result in results:
+        quality = result["quality"]
+        row = [
+            result["checkpoint"],
+            f"{quality['json_valid']:.1%}",
+            f"{quality['mean_f1']:.3f}",
+            f"{quality['f1']['Required Skills']:.3f}",
+        ]
+        row += [f"{latency['ms_per_posting']:.0f}" for latency in result["latency"]]
+        row += [
+            f"{result['latency'][0]['generated_tokens_per_posting']:.0f}",
+            f"{result['mean_f1_per_second']:.3f}",
+        ]
+        rows.append(row)
+
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    lines = [" | ".join(cell.ljust(width) for cell, width in zip(headers, widths))]
+    lines.append("-+-".join("-" * width for width in widths))
+    for row in rows:
+        lines.append(" | ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare extraction quality and latency across checkpoints")
+    parser.add_argument("heldout", help="JSONL file of held-out postings with an expected extraction object")
+    parser.add_argument("checkpoints", nargs="*",
+                        help="Adapter checkpoint directories (default: the server's default adapter)")
+    parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES,
+                        help=f"Comma-separated batch sizes to time (default: {DEFAULT_BATCH_SIZES})")
+    parser.add_argument("--output", default="evaluation.json", help="Where to write the detailed results")
+    args = parser.parse_args()
+
+    postings = load_heldout(args.heldout)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    logger.info(f"Loaded {len(postings)} held-out postings")
+
+    server.load_model()
+    if server.generator is None:
+        raise SystemExit("Model failed to load")
+
+    checkpoints = args.checkpoints or [server.LORA_MODEL_PATH]
+    results = []
+    # Every checkpoint is scored before any is merged, since unmerging 4-bit weights is not exact
+    for index, path in enumerate(checkpoints):
+        with resident(index, path) as name:
+            results.append({"checkpoint": path, "quality": score_checkpoint(name, postings, batch_sizes[0])})
+    for index, path in enumerate(checkpoints):
+        with resident(index, path) as name:
+            result = results[index]
+            result["latency"] = time_checkpoint(name, postings, batch_sizes)
+            result["mean_f1_per_second"] = result["quality"]["mean_f1"] / (result["latency"][0]["p50_ms"] / 1000)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    print(format_table(results, batch_sizes))
+    logger.info(f"Detailed results written to {args.output}")
@@ -1,9 +1,14 @@
 import sys
 import json
 import os
+import random
+import threading
+import time
 import requests
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from google import genai
 from google.genai import types
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
@@ -11,9 +16,10 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QGroupBox, QMessageBox, QComboBox, QFrame, QSizePolicy, QGridLayout,
                              QProgressBar)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QIcon, QPalette, QColor
+from PyQt5.QtGui import QFont, QIcon, QPalette, QColor, QTextCursor
 import os
 from dotenv import load_dotenv
+from Profile_ranker import index_paths, rank_profile, update_profile_index
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,18 +27,344 @@ load_dotenv()
 FASTAPI_SERVER_URL = "http://127.0.0.1:5000"
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+GEMINI_MODEL = "gemini-2.5-flash"
+# Forward only the profile entries most relevant to the job to Gemini
+PROFILE_RANKING = os.getenv('PROFILE_RANKING', '1') == '1'
+# Point the Gemini client at another endpoint, e.g. a local stub server when testing
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL')
+
+# Extractor HTTP client: connect/read timeouts in seconds (the read timeout is per
+# streamed chunk), retries on 5xx with jittered exponential backoff, and an optional
+# hedged second request once a call is slower than the p95 of recent calls
+EXTRACTOR_CONNECT_TIMEOUT = float(os.getenv('EXTRACTOR_CONNECT_TIMEOUT', '5'))
+EXTRACTOR_READ_TIMEOUT = float(os.getenv('EXTRACTOR_READ_TIMEOUT', '120'))
+EXTRACTOR_MAX_RETRIES = int(os.getenv('EXTRACTOR_MAX_RETRIES', '3'))
+EXTRACTOR_RETRY_BACKOFF = float(os.getenv('EXTRACTOR_RETRY_BACKOFF', '0.5'))
+EXTRACTOR_HEDGE = os.getenv('EXTRACTOR_HEDGE', '0') == '1'
+EXTRACTOR_HEDGE_MIN_SECONDS = float(os.getenv('EXTRACTOR_HEDGE_MIN_SECONDS', '2'))
+# Calls observed before the p95 is trusted as a hedging threshold
+EXTRACTOR_HEDGE_MIN_SAMPLES = 20
+# Concurrent extractor calls served without queueing; hedges get a pool of the same size
+EXTRACTOR_MAX_CONCURRENT = int(os.getenv('EXTRACTOR_MAX_CONCURRENT', '4'))
+
+def iter_sse_events(response):
+    """Yield (event, data) pairs from a streaming Server-Sent Events response"""
+    event = "message"
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event = "message"
+            data_lines = []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+    if data_lines:
+        yield event, json.loads("\n".join(data_lines))
+
+class ExtractorError(Exception):
+    pass
+
+class RetryableExtractorError(ExtractorError):
+    """A failure worth retrying: connection problems, timeouts and 5xx responses"""
+
+class ProgressMerger:
+    """Give each request attempt its own progress callback and report only the furthest one.
+
+    Keeps the status text from jumping between a hedged request and the
+    original, or back to zero when a retry restarts the stream.
+    """
+
+    def __init__(self, on_progress):
+        self.on_progress = on_progress
+        self.reported = 0
+        self.lock = threading.Lock()
+
+    def attempt(self):
+        if self.on_progress is None:
+            return None
+        
+        def report(characters):
+            with self.lock:
+                if characters <= self.reported:
+                    return
+                self.reported = characters
+                # Called under the lock so updates from two attempts never arrive out of order
+                self.on_progress(characters)
+        
+        return report
+
+class ExtractorClient:
+    """Keep-alive HTTP client for the extraction server, shared by every worker thread"""
+
+    def __init__(self, base_url=FASTAPI_SERVER_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # A primary and a hedge per call
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2 * EXTRACTOR_MAX_CONCURRENT)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latencies = deque(maxlen=200)
+        self.lock = threading.Lock()
+        # Separate pools, so hedges never queue behind the primaries they are meant to back up
+        self.primary_executor = ThreadPoolExecutor(max_workers=EXTRACTOR_MAX_CONCURRENT, thread_name_prefix="extractor")
+        self.hedge_executor = ThreadPoolExecutor(max_workers=EXTRACTOR_MAX_CONCURRENT, thread_name_prefix="extractor-hedge")
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while hedging is off or there is too little history"""
+        if not EXTRACTOR_HEDGE:
+            return None
+        with self.lock:
+            if len(self.latencies) < EXTRACTOR_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return max(latencies[int(len(latencies) * 0.95) - 1], EXTRACTOR_HEDGE_MIN_SECONDS)
+
+    def extract_stream(self, payload, on_progress=None):
+        """POST to /extract/stream and return the final ``done`` payload.
+
+        on_progress(characters) is called as tokens arrive, possibly from a
+        background thread. A hedged request guards against a stalled
+        connection only: the server coalesces it onto the generation already
+        running, so it cannot speed up a slow generation.
+        """
+        start = time.perf_counter()
+        cancelled = threading.Event()
+        delay = self.hedge_delay()
+        hedged = False
+        progress = ProgressMerger(on_progress)
+        try:
+            if delay is None:
+                result = self._with_retries(payload, progress.attempt(), cancelled)
+            else:
+                primary = self.primary_executor.submit(self._with_retries, payload, progress.attempt(), cancelled)
+                done, _ = wait([primary], timeout=delay)
+                if done:
+                    result = primary.result()
+                else:
+                    hedged = True
+                    print(f"Extractor call slower than {delay:.1f}s, sending a hedged request")
+                    hedge = self.hedge_executor.submit(self._with_retries, payload, progress.attempt(), cancelled)
+                    result = self._first_result([primary, hedge])
+        finally:
+            # Stops whichever request lost the race
+            cancelled.set()
+        
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+        print(f"Extractor call took {elapsed:.2f}s{' (hedged)' if hedged else ''}")
+        return result
+
+    def _first_result(self, futures):
+        """Result of the first future to succeed, or the first error when every one fails"""
+        errors = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    def _with_retries(self, payload, on_progress, cancelled):
+        for attempt in range(EXTRACTOR_MAX_RETRIES + 1):
+            try:
+                return self._stream_once(payload, on_progress, cancelled)
+            except RetryableExtractorError as e:
+                if attempt == EXTRACTOR_MAX_RETRIES or cancelled.is_set():
+                    raise
+                # Full jitter keeps many clients from retrying in lockstep
+                delay = random.uniform(0, EXTRACTOR_RETRY_BACKOFF * 2 ** attempt)
+                print(f"Extractor request failed ({e}), retrying in {delay:.2f}s")
+                if cancelled.wait(delay):
+                    raise
+
+    def _stream_once(self, payload, on_progress, cancelled):
+        try:
+            response = self.session.post(
+                f"{self.base_url}/extract/stream",
+                json=payload,
+                stream=True,
+                timeout=(EXTRACTOR_CONNECT_TIMEOUT, EXTRACTOR_READ_TIMEOUT),
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise RetryableExtractorError(str(e))
+        
+        with response:
+            if response.status_code >= 500:
+                # Includes 503 while the model is still loading
+                try:
+                    message = response.json().get("error", response.reason)
+                except ValueError:
+                    message = response.reason
+                raise RetryableExtractorError(f"{response.status_code} {message}")
+            if response.status_code >= 400:
+                raise ExtractorError(f"{response.status_code} {response.reason}")
+            
+            characters = 0
+            try:
+                for event, data in iter_sse_events(response):
+                    if cancelled.is_set():
+                        return None
+                    if event == "done":
+                        return data
+                    if event == "error":
+                        raise ExtractorError(data.get('error', 'unknown error'))
+                    characters += len(data.get("token", ""))
+                    if on_progress is not None:
+                        on_progress(characters)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                raise RetryableExtractorError(str(e))
+        raise RetryableExtractorError("stream ended without a result")
+
+extractor_client = ExtractorClient()
+
+_gemini_client = None
+_gemini_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """Process-wide Gemini client, created on first use so its connections are reused across generations"""
+    global _gemini_client
+    with _gemini_client_lock:
+        if _gemini_client is None:
+            http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+            _gemini_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+        return _gemini_client
+
+class ResumeOutputSplitter:
+    """Split streamed Gemini output into the LaTeX resume and the cover letter as it arrives.
+
+    The resume is written as soon as \\end{document} streams past; everything
+    after it is collected as the cover letter and written by close().
+    """
+    END_DOCUMENT = r"\end{document}"
+
+    def __init__(self, resume_path="generated_resume.tex", cover_letter_path="cover_letter.txt"):
+        self.resume_path = resume_path
+        self.cover_letter_path = cover_letter_path
+        self.buffer = ""
+        self.search_from = 0
+        self.resume_done = False
+        self.cover_letter = []
+
+    def feed(self, chunk):
+        """Add a chunk of output; returns True when this chunk completed the resume"""
+        if self.resume_done:
+            self.cover_letter.append(chunk)
+            return False
+        
+        self.buffer += chunk
+        end_pos = self.buffer.find(self.END_DOCUMENT, self.search_from)
+        if end_pos == -1:
+            # The marker can straddle two chunks, so rescan the tail next time
+            self.search_from = max(len(self.buffer) - len(self.END_DOCUMENT) + 1, 0)
+            return False
+        
+        split = end_pos + len(self.END_DOCUMENT)
+        latex_part = self.buffer[:split].strip()
+        latex_part = latex_part.strip("``````").strip()
+        with open(self.resume_path, "w", encoding="utf-8") as f:
+            f.write(latex_part)
+        print(f"✅ Resume saved as {self.resume_path}")
+        
+        self.cover_letter.append(self.buffer[split:])
+        self.resume_done = True
+        return True
+
+    def close(self):
+        """Write the cover letter once the stream has ended"""
+        if not self.resume_done:
+            raise ValueError("Output format is incorrect. Expected '\\end{document}' in LaTeX resume.")
+        
+        cover_letter = "".join(self.cover_letter).strip()
+        cover_letter = cover_letter.replace("**Cover Letter**", "").strip()
+        with open(self.cover_letter_path, "w", encoding="utf-8") as f:
+            f.write(cover_letter)
+        print(f"✅ Cover letter saved as {self.cover_letter_path}")
+
+def extract_required_skills(job_data, on_progress=None):
+    """Extracted requirements for one job ({job_title, company, description}) from the extraction server"""
+    payload = {
+        'job_title': job_data.get('job_title', ''),
+        'company': job_data.get('company', ''),
+        'job_description': job_data.get('description', '')
+    }
+    
+    # POST keeps long descriptions out of the URL
+    result = extractor_client.extract_stream(payload, on_progress=on_progress) or {}
+    
+    if result.get("success") and "response" in result:
+        return result["response"]
+    return "Skills extraction failed"
+
+def format_resume_prompt(template, data):
+    """Fill the prompt template with the (ranked) user profile and the job requirements"""
+    return (
+        template.replace("<<USER_PROFILE>>", json.dumps(data["user_profile"], indent=2))
+                .replace("<<JOB_REQUIREMENTS>>", json.dumps(data["job_requirements"], indent=2))
+    )
+
+def stream_gemini(formatted_prompt, on_chunk, client=None):
+    """Stream one Gemini generation, calling on_chunk(text) for every non-empty chunk.
+
+    Returns ``(output, stats)`` where stats holds the time to the first chunk,
+    the total time and Gemini's reported prompt token count.
+    """
+    client = client or get_gemini_client()
+    contents = [
+        types.Content(
+            role="user",
+            parts=[types.Part.from_text(text=formatted_prompt)],
+        )
+    ]
+
+    start = time.perf_counter()
+    first_chunk = None
+    parts = []
+    usage = None
+    for chunk in client.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=contents,
+    ):
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        text = chunk.text or ""
+        if not text:
+            continue
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        parts.append(text)
+        on_chunk(text)
+    
+    stats = {
+        "first_chunk_seconds": first_chunk,
+        "seconds": time.perf_counter() - start,
+        "prompt_tokens": getattr(usage, "prompt_token_count", None) if usage is not None else None,
+    }
+    return "".join(parts), stats
+
 class ResumeGenerationWorker(QThread):
     """Worker thread for handling resume generation to avoid UI freezing"""
     progress_updated = pyqtSignal(int)
     status_updated = pyqtSignal(str)
     finished = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
+    # Text chunks from Gemini as they stream in, for the live preview
+    chunk_received = pyqtSignal(str)
 
-    def __init__(self, user_data, job_data, prompt_template):
+    def __init__(self, user_data, job_data, prompt_template, gemini_client=None, profile_path=None):
         super().__init__()
         self.user_data = user_data
         self.job_data = job_data
         self.prompt_template = prompt_template
+        # Where user_data was saved; its precomputed index is used for ranking
+        self.profile_path = profile_path
+        # Anything with models.generate_content_stream() works, e.g. a stub in tests
+        self.gemini_client = gemini_client
 
     def run(self):
         try:
@@ -44,6 +376,15 @@ class ResumeGenerationWorker(QThread):
             self.progress_updated.emit(30)
             self.status_updated.emit("Preparing data for Gemini API...")
             
+            user_profile = self.user_data
+            if PROFILE_RANKING:
+                user_profile, report = rank_profile(self.user_data, required_skills, profile_path=self.profile_path)
+                if not report["ranked"]:
+                    print("Extracted requirements are not parseable; sending the whole profile")
+                else:
+                    print(f"Profile ranking kept {report['entries_after']}/{report['entries_before']} entries: "
+                          f"~{report['profile_tokens_before']} -> ~{report['profile_tokens_after']} profile tokens")
+            
             job_requirements = {
             "job_title": self.job_data.get('job_title', ''),
             "company": self.job_data.get('company', ''),
@@ -51,19 +392,20 @@ class ResumeGenerationWorker(QThread):
             }
 
             combined_data = {
-                "user_profile": self.user_data,
+                "user_profile": user_profile,
                 "job_requirements": job_requirements
             }
             
             self.progress_updated.emit(50)
             self.status_updated.emit("Generating resume with Gemini AI...")
             
-            resume_content = self.generate_resume_with_gemini(combined_data)
+            splitter = ResumeOutputSplitter()
+            resume_content = self.generate_resume_with_gemini(combined_data, splitter)
             
             self.progress_updated.emit(80)
             self.status_updated.emit("Saving generated resume...")
             
-            self.save_resume_and_cover_letter(resume_content)
+            splitter.close()
             
             self.progress_updated.emit(100)
             self.status_updated.emit("Resume generated successfully!")
@@ -73,82 +415,41 @@ class ResumeGenerationWorker(QThread):
             self.error_occurred.emit(str(e))
 
     def get_required_skills(self):
-        """Get required skills from Flask server using GET method"""
+        """Get required skills from Flask server, consuming the extraction as it streams"""
         try:
-            job_title = self.job_data.get('job_title', '')
-            company = self.job_data.get('company', '')
-            job_description = self.job_data.get('description', '')
-            
-            params = {
-                'job_title': job_title,
-                'company': company,
-                'job_description': job_description
-            }
-            
-            response = requests.get(f"{FASTAPI_SERVER_URL}/extract", params=params)
-            response.raise_for_status()
-            
-            result = response.json()
-            
-            if result.get("success") and "response" in result:
-                return result["response"]
-            else:
-                return "Skills extraction failed"
+            return extract_required_skills(
+                self.job_data,
+                on_progress=lambda characters: self.status_updated.emit(
+                    f"Extracting job requirements... ({characters} characters received)"
+                ),
+            )
             
-        except requests.exceptions.RequestException as e:
+        except (ExtractorError, requests.exceptions.RequestException) as e:
             raise Exception(f"Flask server error: {str(e)}")
 
-    def save_resume_and_cover_letter(self, output: str):
-        end_doc_str = r"\end{document}"
-        end_pos = output.find(end_doc_str)
-    
-        if end_pos == -1:
-            raise ValueError("Output format is incorrect. Expected '\\end{document}' in LaTeX resume.")
-    
-        latex_part = output[:end_pos + len(end_doc_str)].strip()
-        cover_letter = output[end_pos + len(end_doc_str):].strip()
-    
-        latex_part = latex_part.strip("``````").strip()
-    
-        cover_letter = cover_letter.replace("**Cover Letter**", "").strip()
-    
-        with open("generated_resume.tex", "w", encoding="utf-8") as f:
-            f.write(latex_part)
-    
-        with open("cover_letter.txt", "w", encoding="utf-8") as f:
-            f.write(cover_letter)
-    
-        print("✅ Resume saved as resume.tex")
-        print("✅ Cover letter saved as cover_letter.txt")
-
-    
-    def generate_resume_with_gemini(self, data):
-        """Generate resume using Gemini API"""
+    def generate_resume_with_gemini(self, data, splitter=None):
+        """Generate resume using Gemini API, streaming chunks to the preview (and splitter) as they arrive"""
         try:
-            client = genai.Client(api_key=GEMINI_API_KEY)
-            
             # Load prompt template
             prompt = self.load_prompt_template()
             
             # Format prompt with data
-            formatted_prompt = (
-                prompt.replace("<<USER_PROFILE>>", json.dumps(data["user_profile"], indent=2))
-                      .replace("<<JOB_REQUIREMENTS>>", json.dumps(data["job_requirements"], indent=2))
-            )
+            formatted_prompt = format_resume_prompt(prompt, data)
             
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[types.Part.from_text(text=formatted_prompt)],
-                )
-            ]
-
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=contents,
-            )
+            def on_chunk(text):
+                self.chunk_received.emit(text)
+                if splitter is not None and splitter.feed(text):
+                    self.progress_updated.emit(65)
+                    self.status_updated.emit("Resume complete, writing cover letter...")
+
+            output, stats = stream_gemini(formatted_prompt, on_chunk, self.gemini_client)
+            if stats["first_chunk_seconds"] is not None:
+                print(f"Gemini first chunk after {stats['first_chunk_seconds']:.2f}s")
+            print(f"Gemini generation took {stats['seconds']:.2f}s")
+            if stats["prompt_tokens"]:
+                print(f"Gemini prompt tokens: {stats['prompt_tokens']}")
 
-            return response.text
+            return output
             
         except Exception as e:
             raise Exception(f"Gemini API error: {str(e)}")
@@ -162,7 +463,8 @@ class ResumeGenerationWorker(QThread):
             # Fallback prompt if file doesn't exist
             return self.get_default_prompt()
 
-    def get_default_prompt(self):
+    @staticmethod
+    def get_default_prompt():
         """Default prompt template"""
         return """You are an AI assistant that edits LaTeX resumes and writes cover letters.
 
@@ -393,8 +695,15 @@ class UserProfileApp(QMainWindow):
             }
         """)
         
+        # Live preview of the resume and cover letter while Gemini streams them
+        self.preview_output = QTextEdit()
+        self.preview_output.setReadOnly(True)
+        self.preview_output.setPlaceholderText("The generated resume and cover letter appear here as they are written...")
+        self.preview_output.setMaximumHeight(200)
+        
         progress_layout.addWidget(self.progress_label)
         progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.preview_output)
         self.progress_frame.setVisible(False)
         main_layout.addWidget(self.progress_frame)
         
@@ -832,10 +1141,16 @@ Please generate the customized resume and cover letter based on the provided inf
         try:
             with open(self.user_data_file, 'w') as f:
                 json.dump(data, f, indent=2)
-            return data
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to save user data: {str(e)}")
             return None
+        
+        try:
+            # Only entries whose content changed are re-tokenized
+            update_profile_index(self.user_data_file, data)
+        except Exception as e:
+            print(f"Failed to update profile index: {str(e)}")
+        return data
     
     def get_job_data(self):
         """Get job application data"""
@@ -882,17 +1197,27 @@ Please generate the customized resume and cover letter based on the provided inf
         self.progress_frame.setVisible(True)
         self.progress_bar.setValue(0)
         self.progress_label.setText("Preparing...")
+        self.preview_output.clear()
         
         self.generate_button.setEnabled(False)
         self.generate_button.setText("Generating...")
         
-        self.worker = ResumeGenerationWorker(user_data, job_data, None)
+        self.worker = ResumeGenerationWorker(user_data, job_data, None, profile_path=self.user_data_file)
         self.worker.progress_updated.connect(self.progress_bar.setValue)
         self.worker.status_updated.connect(self.progress_label.setText)
+        self.worker.chunk_received.connect(self.append_preview)
         self.worker.finished.connect(self.on_resume_generated)
         self.worker.error_occurred.connect(self.on_generation_error)
         self.worker.start()
     
+    def append_preview(self, text):
+        """Append a streamed chunk to the preview pane and keep it scrolled to the end"""
+        cursor = self.preview_output.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        self.preview_output.setTextCursor(cursor)
+        self.preview_output.ensureCursorVisible()
+    
     def on_resume_generated(self, resume_content):
         """Handle successful resume generation"""
         self.progress_frame.setVisible(False)
@@ -948,8 +1273,9 @@ Please generate the customized resume and cover letter based on the provided inf
                 else:
                     field.clear()
             
-            if os.path.exists(self.user_data_file):
-                os.remove(self.user_data_file)
+            for path in (self.user_data_file, *index_paths(self.user_data_file)):
+                if os.path.exists(path):
+                    os.remove(path)
             
             success_msg = QMessageBox(self)
             success_msg.setIcon(QMessageBox.Information)
@@ -1,9 +1,25 @@
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, pipeline
+from flask import Flask, request, jsonify, g, Response, stream_with_context
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, pipeline
 from peft import PeftModel
+from huggingface_hub import snapshot_download
 import torch
+import argparse
+import copy
+import csv
 import json
 import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import hashlib
+import hmac
+import re
+import shutil
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import Future
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -11,108 +27,1789 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+BASE_MODEL_PATH = "./Mistral-7B-Instruct-v0.2"
+LORA_MODEL_PATH = "./mistral-job-extractor/checkpoint-200"
+# Pre-merged, pre-quantized artifact written by `python Mistral_server.py --export`
+MERGED_MODEL_PATH = os.getenv("EXTRACT_MERGED_MODEL_PATH", "./mistral-job-extractor-merged")
+# Keep the base model unmerged so several LoRA adapters can be loaded and selected per request
+MULTI_ADAPTER = os.getenv("EXTRACT_MULTI_ADAPTER", "0") == "1"
+DEFAULT_ADAPTER = "default"
+MAX_ADAPTERS = int(os.getenv("EXTRACT_MAX_ADAPTERS", "4"))
+ADAPTER_MEMORY_BUDGET_MB = float(os.getenv("EXTRACT_ADAPTER_MEMORY_BUDGET_MB", "512"))
+# Shared secret required in the X-Admin-Token header of /admin requests (unset = /admin disabled)
+ADMIN_TOKEN = os.getenv("EXTRACT_ADMIN_TOKEN", "")
+# "cuda" serves the bitsandbytes 4-bit model, "cpu" serves a dynamically int8-quantized model
+BACKEND = os.getenv("EXTRACT_BACKEND", "cuda").lower()
+# Intra-op threads for the CPU backend (0 = one per physical core)
+CPU_THREADS = int(os.getenv("EXTRACT_CPU_THREADS", "0"))
+MAX_NEW_TOKENS = 512
+TEMPERATURE = 0.2
+# Stop decoding as soon as the extracted JSON object closes
+STOP_ON_JSON_CLOSE = os.getenv("EXTRACT_STOP_ON_JSON_CLOSE", "1") == "1"
+# Mask logits so the output always parses as the six-key extraction object
+CONSTRAINED_DECODING = os.getenv("EXTRACT_CONSTRAINED_DECODING", "0") == "1"
+# Reuse the precomputed past_key_values of the static instruction header
+PREFIX_CACHE = os.getenv("EXTRACT_PREFIX_CACHE", "1") == "1"
+# Assisted generation: "off", "prompt_lookup" (n-gram drafts copied from the prompt) or "draft" (small draft model)
+SPECULATIVE_MODE = os.getenv("EXTRACT_SPECULATIVE", "off").lower()
+PROMPT_LOOKUP_TOKENS = int(os.getenv("EXTRACT_PROMPT_LOOKUP_TOKENS", "10"))
+DRAFT_MODEL_PATH = os.getenv("EXTRACT_DRAFT_MODEL_PATH", "")
+
+PROMPT_PREFIX = """### Instruction:
+Extract the following information from the job description in a structured JSON format.
+The JSON should have exactly these keys: "Core Responsibilities", "Required Skills", "Educational Requirements", "Experience Level", "Preferred Qualifications", "Compensation and Benefits".
+If information for a key is not present, use "N/A".
+
+"""
+
+EXTRACTION_KEYS = [
+    "Core Responsibilities",
+    "Required Skills",
+    "Educational Requirements",
+    "Experience Level",
+    "Preferred Qualifications",
+    "Compensation and Benefits",
+]
+
+# Micro-batching configuration
+MAX_BATCH_SIZE = int(os.getenv("EXTRACT_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.getenv("EXTRACT_MAX_BATCH_WAIT_MS", "10"))
+
+# Extraction cache configuration (an empty EXTRACT_CACHE_DB disables the on-disk tier)
+CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "1024"))
+CACHE_DB_PATH = os.getenv("EXTRACT_CACHE_DB", "")
+
+# Largest number of postings accepted by one /extract/batch call
+MAX_BULK_POSTINGS = int(os.getenv("EXTRACT_MAX_BULK_POSTINGS", "500"))
+
+# Job description pre-processing: strip boilerplate, then keep the highest ranked
+# sections within a token budget (0 = no budget). Descriptions longer than
+# EXTRACT_MAP_REDUCE_TOKENS after cleanup are extracted chunk by chunk instead.
+STRIP_BOILERPLATE = os.getenv("EXTRACT_STRIP_BOILERPLATE", "1") == "1"
+INPUT_TOKEN_BUDGET = int(os.getenv("EXTRACT_INPUT_TOKEN_BUDGET", "1536"))
+MAP_REDUCE_TOKENS = int(os.getenv("EXTRACT_MAP_REDUCE_TOKENS", "6144"))
+MAX_CHUNKS = int(os.getenv("EXTRACT_MAX_CHUNKS", "8"))
+
+# Offline extraction (--extract-file): records read ahead and sorted by length before batching
+OFFLINE_WINDOW = int(os.getenv("EXTRACT_OFFLINE_WINDOW", "256"))
+
+# Asynchronous job API configuration
+MAX_PENDING_JOBS = int(os.getenv("EXTRACT_MAX_PENDING_JOBS", "64"))
+JOB_RESULT_TTL = float(os.getenv("EXTRACT_JOB_RESULT_TTL", "3600"))
+JOB_RETRY_AFTER = int(os.getenv("EXTRACT_JOB_RETRY_AFTER", "5"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
 generator = None
+batch_queue = None
+schema_vocabulary = None
+adapter_registry = None
+draft_model = None
+single_flight = None
+job_store = None
+model_source = f"{BASE_MODEL_PATH}|{LORA_MODEL_PATH}"
+startup_seconds = None
+extraction_cache = None
 
-def load_model():
-    """Load the model and tokenizer once when the server starts"""
-    global generator
+
+def format_labels(labels):
+    """Render a label dict in Prometheus text exposition syntax"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram rendered in the Prometheus text format"""
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, observed) in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {observed}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(key)} {observed}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter rendered in the Prometheus text format"""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("extractor_request_seconds", "End-to-end HTTP request latency.")
+REQUESTS_TOTAL = Counter("extractor_requests_total", "HTTP requests by endpoint and status code.")
+QUEUE_WAIT_SECONDS = Histogram("extractor_queue_wait_seconds", "Time a prompt waited in the batch queue before generation started.")
+STAGE_SECONDS = Histogram("extractor_stage_seconds", "Time spent in each extraction stage.")
+BATCH_SIZE = Histogram("extractor_batch_size", "Number of prompts generated together.", (1, 2, 4, 8, 16, 32, 64))
+INPUT_TOKENS = Histogram("extractor_input_tokens", "Prompt length in tokens.", TOKEN_BUCKETS)
+GENERATED_TOKENS = Histogram("extractor_generated_tokens", "Tokens generated per prompt.", TOKEN_BUCKETS)
+TOKENS_PER_SECOND = Histogram("extractor_tokens_per_second", "Generated tokens per second of generate() time, per batch.", RATE_BUCKETS)
+INPUT_TOKENS_REMOVED = Histogram("extractor_input_tokens_removed", "Job description tokens removed by pre-processing, per request.", TOKEN_BUCKETS)
+MAP_REDUCE_CHUNKS = Histogram("extractor_map_reduce_chunks", "Chunks extracted separately for descriptions over the map-reduce threshold.", (2, 3, 4, 6, 8, 12, 16))
+COALESCED_REQUESTS = Counter("extractor_coalesced_requests_total", "Requests that joined an identical in-flight extraction instead of generating.")
+SPECULATIVE_PROPOSED = Counter("extractor_speculative_proposed_tokens_total", "Draft tokens proposed to the main model for verification.")
+SPECULATIVE_ACCEPTED = Counter("extractor_speculative_accepted_tokens_total", "Draft tokens accepted by the main model.")
+SPECULATIVE_STEPS = Counter("extractor_speculative_verify_steps_total", "Main-model verification forward passes.")
+SPECULATIVE_ACCEPTANCE = Histogram("extractor_speculative_acceptance_rate", "Fraction of proposed draft tokens accepted, per request.",
+                                   (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+
+METRICS = [
+    REQUEST_SECONDS, REQUESTS_TOTAL, QUEUE_WAIT_SECONDS, STAGE_SECONDS,
+    BATCH_SIZE, INPUT_TOKENS, GENERATED_TOKENS, TOKENS_PER_SECOND, COALESCED_REQUESTS,
+    INPUT_TOKENS_REMOVED, MAP_REDUCE_CHUNKS,
+    SPECULATIVE_PROPOSED, SPECULATIVE_ACCEPTED, SPECULATIVE_STEPS, SPECULATIVE_ACCEPTANCE,
+]
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies of a posting share a cache entry"""
+    return " ".join((text or "").split())
+
+
+def model_identity():
+    """Identify the model, adapter and generation settings that produced a cached result"""
+    return (
+        f"{model_source}|backend={BACKEND}|max_new_tokens={MAX_NEW_TOKENS}|temperature={TEMPERATURE}"
+        f"|stop_on_json_close={STOP_ON_JSON_CLOSE}|constrained={CONSTRAINED_DECODING}"
+        f"|strip_boilerplate={'sentences' if STRIP_BOILERPLATE else 'off'}|input_budget={INPUT_TOKEN_BUDGET}"
+        f"|map_reduce={MAP_REDUCE_TOKENS}x{MAX_CHUNKS}"
+    )
+
+
+def cache_key(job_title, company, job_description, adapter=DEFAULT_ADAPTER):
+    """Content hash of the normalized posting plus the model and adapter identity"""
+    adapter_path = adapter_registry.path(adapter) if adapter_registry is not None else None
+    payload = json.dumps([
+        model_identity(),
+        f"{adapter}={adapter_path}",
+        normalize_text(job_title),
+        normalize_text(company),
+        normalize_text(job_description),
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events message carrying a JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+class ExtractionCache:
+    """Two-tier result cache: a bounded in-memory LRU backed by an optional sqlite file.
+
+    Entries are ``(prompt, response)`` pairs, so a hit needs no pre-processing
+    to rebuild the prompt. The sqlite file stores the response and the length
+    of its prompt prefix.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, db_path=CACHE_DB_PATH):
+        self.max_size = max(0, max_size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, prompt_length INTEGER)"
+            )
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(extractions)")}
+            if "prompt_length" not in columns:
+                # Rows from older versions have no prompt length and are treated as misses
+                self.db.execute("ALTER TABLE extractions ADD COLUMN prompt_length INTEGER")
+            self.db.commit()
+            logger.info(f"Using on-disk extraction cache at {db_path}")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return self.entries[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT response, prompt_length FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] is not None:
+                    self.disk_hits += 1
+                    entry = (row[0][:row[1]], row[0])
+                    self._remember(key, entry)
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, prompt, response):
+        with self.lock:
+            self._remember(key, (prompt, response))
+            if self.db is not None:
+                # Responses begin with their prompt; one that does not is stored but never served from disk
+                prompt_length = len(prompt) if response.startswith(prompt) else None
+                self.db.execute(
+                    "INSERT OR REPLACE INTO extractions (key, response, created, prompt_length) VALUES (?, ?, ?, ?)",
+                    (key, response, time.time(), prompt_length),
+                )
+                self.db.commit()
+
+    def _remember(self, key, entry):
+        if self.max_size == 0:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.entries),
+                "max_memory_entries": self.max_size,
+                "persistent": self.db is not None,
+            }
+
+
+class JsonObjectScanner:
+    """Track brace depth and string state to find where the first top-level JSON object closes"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.closed = False
+
+    def feed(self, text):
+        """Consume text and return the offset just past the closing brace, or None while the object is open"""
+        if self.closed:
+            return 0
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                    return i + 1
+        return None
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """Stop each sequence once its generated JSON object is closed"""
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.scanners = None
+        self.seen = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.scanners is None:
+            self.scanners = [JsonObjectScanner() for _ in range(input_ids.shape[0])]
+        # Several tokens may have been appended since the last call (assisted generation)
+        new_text = self.tokenizer.batch_decode(input_ids[:, self.seen:], skip_special_tokens=True)
+        self.seen = input_ids.shape[1]
+        done = [
+            scanner.closed or scanner.feed(text) is not None
+            for scanner, text in zip(self.scanners, new_text)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class SchemaState:
+    """Character-level automaton for the extraction object.
+
+    The output is restricted to the canonical layout
+    ``{"Core Responsibilities": <value>, "Required Skills": <value>, ...}``
+    where every value is a string, a list of strings or a flat object of
+    strings. Outside of free string content the automaton is always waiting
+    for one of a few fixed literals, stored as ``alternatives`` mapping the
+    literal to the transition taken once it is fully matched.
+    """
+
+    def __init__(self):
+        self.key_index = 0
+        self.valid = True
+        self._expect({"{": "_key"})
+
+    def _expect(self, alternatives):
+        self.mode = "literal"
+        self.alternatives = alternatives
+        self.matched = ""
+
+    def _string(self, on_close):
+        self.mode = "string"
+        self.on_close = on_close
+
+    def _key(self):
+        self._expect({f'"{EXTRACTION_KEYS[self.key_index]}": ': "_value"})
+
+    def _value(self):
+        self._expect({'"': "_value_string", "[": "_array", "{": "_object"})
+
+    def _value_string(self):
+        self._string("_value_end")
+
+    def _value_end(self):
+        self.key_index += 1
+        if self.key_index < len(EXTRACTION_KEYS):
+            self._expect({", ": "_key"})
+        else:
+            self._expect({"}": "_done"})
+
+    def _array(self):
+        self._expect({'"': "_array_item", "]": "_value_end"})
+
+    def _array_item(self):
+        self._string("_array_item_end")
+
+    def _array_item_end(self):
+        self._expect({', "': "_array_item", "]": "_value_end"})
+
+    def _object(self):
+        self._expect({'"': "_object_key", "}": "_value_end"})
+
+    def _object_key(self):
+        self._string("_object_key_end")
+
+    def _object_key_end(self):
+        self._expect({': "': "_object_value"})
+
+    def _object_value(self):
+        self._string("_object_value_end")
+
+    def _object_value_end(self):
+        self._expect({', "': "_object_key", "}": "_value_end"})
+
+    def _done(self):
+        self.mode = "done"
+
+    def remaining(self):
+        """Unmatched tails of the literals the automaton is waiting for"""
+        return [literal[len(self.matched):] for literal in self.alternatives]
+
+    def feed(self, text):
+        """Advance over text; returns False (and marks the state invalid) on the first illegal character"""
+        for ch in text:
+            if self.mode == "string":
+                if ch == '"':
+                    getattr(self, self.on_close)()
+                elif ch == "\\" or ord(ch) < 0x20:
+                    self.valid = False
+            elif self.mode == "literal":
+                candidate = self.matched + ch
+                if candidate in self.alternatives:
+                    getattr(self, self.alternatives[candidate])()
+                elif any(literal.startswith(candidate) for literal in self.alternatives):
+                    self.matched = candidate
+                else:
+                    self.valid = False
+            else:
+                self.valid = False
+            if not self.valid:
+                return False
+        return True
+
+    def accepts(self, text):
+        """Check whether text is a legal continuation without changing this state"""
+        return copy.copy(self).feed(text)
+
+
+class SchemaVocabulary:
+    """Per-tokenizer lookup tables used to turn a SchemaState into a set of allowed token ids"""
+
+    def __init__(self, tokenizer):
+        self.eos_token_id = tokenizer.eos_token_id
+        special_ids = set(tokenizer.all_special_ids)
+        self.texts = []
+        for token_id, piece in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+            self.texts.append(None if token_id in special_ids or piece is None else self._piece_text(piece))
+        
+        self.by_text = {}
+        self.by_first_char = {}
+        self.quote_ids = []
+        plain_ids = []
+        for token_id, text in enumerate(self.texts):
+            if not text:
+                continue
+            self.by_text.setdefault(text, token_id)
+            self.by_first_char.setdefault(text[0], []).append(token_id)
+            if '"' in text:
+                self.quote_ids.append(token_id)
+            elif "\\" not in text and all(ord(ch) >= 0x20 for ch in text):
+                plain_ids.append(token_id)
+        self.plain_ids = torch.tensor(plain_ids, dtype=torch.long)
+
+    @staticmethod
+    def _piece_text(piece):
+        """Map a sentencepiece token to the text it contributes to the output"""
+        if piece.startswith("<0x") and piece.endswith(">") and len(piece) == 6:
+            byte = int(piece[3:5], 16)
+            # Continuation bytes of multi-byte characters can only appear inside strings
+            return chr(byte) if byte < 0x80 else "\uFFFD"
+        return piece.replace("\u2581", " ")
+
+    def allowed_ids(self, state):
+        """Token ids that keep the output inside the schema"""
+        if not state.valid or state.mode == "done":
+            return torch.tensor([self.eos_token_id], dtype=torch.long)
+        
+        if state.mode == "string":
+            closing = [token_id for token_id in self.quote_ids if state.accepts(self.texts[token_id])]
+            return torch.cat([self.plain_ids, torch.tensor(closing, dtype=torch.long)])
+        
+        remaining = state.remaining()
+        if len(remaining) == 1:
+            # Fixed key names and punctuation: emit the longest matching token directly
+            literal = remaining[0]
+            for end in range(len(literal), 0, -1):
+                if literal[:end] in self.by_text:
+                    return torch.tensor([self.by_text[literal[:end]]], dtype=torch.long)
+        
+        candidates = set()
+        for literal in remaining:
+            candidates.update(self.by_first_char.get(literal[0], []))
+        allowed = [token_id for token_id in candidates if state.accepts(self.texts[token_id])]
+        return torch.tensor(allowed or [self.eos_token_id], dtype=torch.long)
+
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """Mask every token that would take a sequence outside the extraction schema.
+
+    The automaton state after every generated position is kept per row, so
+    calls on shorter prefixes (candidate tokens rejected during assisted
+    generation) rewind instead of corrupting the state.
+    """
+
+    def __init__(self, vocabulary, prompt_length):
+        self.vocabulary = vocabulary
+        self.prompt_length = prompt_length
+        self.history = None
+
+    def _state_at(self, row, input_ids):
+        history = self.history[row]
+        generated = input_ids.shape[1] - self.prompt_length
+        del history[generated + 1:]
+        while len(history) <= generated:
+            state = copy.copy(history[-1])
+            if state.mode != "done" and state.valid:
+                token_id = input_ids[row, self.prompt_length + len(history) - 1].item()
+                state.feed(self.vocabulary.texts[token_id] or "")
+            history.append(state)
+        return history[generated]
+
+    def __call__(self, input_ids, scores):
+        if self.history is None:
+            self.history = [[SchemaState()] for _ in range(input_ids.shape[0])]
+        
+        mask = torch.full_like(scores, float("-inf"))
+        for row in range(input_ids.shape[0]):
+            state = self._state_at(row, input_ids)
+            allowed = self.vocabulary.allowed_ids(state).to(scores.device)
+            mask[row, allowed[allowed < scores.shape[-1]]] = 0
+        return scores + mask
+
+
+class AdapterRegistry:
+    """LoRA adapters served from one resident base model.
+
+    In the default (merged) mode the only adapter is the one merged into the
+    weights at startup. With EXTRACT_MULTI_ADAPTER=1 the base model stays
+    unmerged and adapters can be loaded, selected per request and unloaded at
+    runtime. ``lock`` is held while generating and while adapters change, so
+    switching never happens in the middle of a batch.
+    """
+
+    def __init__(self, model, tokenizer, multi):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.multi = multi
+        self.adapters = {}
+        self.lock = threading.RLock()
+
+    def register(self, name, path):
+        """Record an adapter that is already part of the model and prefill its prefix cache"""
+        with self.lock:
+            if self.multi:
+                self.model.set_adapter(name)
+            size_bytes = self._adapter_bytes(name) if self.multi else 0
+            prefix = None
+            if PREFIX_CACHE:
+                logger.info(f"Prefilling instruction prefix cache for adapter {name}...")
+                prefix = PromptPrefixCache(self.model, self.tokenizer)
+                logger.info(f"Cached {prefix.length} prefix tokens")
+            self.adapters[name] = {"path": path, "bytes": size_bytes, "prefix_cache": prefix, "loaded": time.time()}
+
+    def load(self, name, path):
+        """Load a new adapter next to the resident ones, enforcing the count and memory budgets.
+
+        Downloading and sizing the adapter happen before ``lock`` is taken, so
+        generation only pauses for reading the weights into the model.
+        """
+        if not self.multi:
+            raise ValueError("Adapters can only be loaded when the server runs with EXTRACT_MULTI_ADAPTER=1")
+        self._check_capacity(name)
+        local_path = path if os.path.isdir(path) else snapshot_download(path)
+        estimate_mb = self._estimate_bytes(local_path) / 2**20
+        if estimate_mb > ADAPTER_MEMORY_BUDGET_MB:
+            raise ValueError(
+                f"Adapter '{name}' needs about {estimate_mb:.1f} MB, over the {ADAPTER_MEMORY_BUDGET_MB:.0f} MB budget"
+            )
+        
+        with self.lock:
+            self._check_capacity(name)
+            logger.info(f"Loading adapter {name} from {path}...")
+            self.model.load_adapter(local_path, adapter_name=name)
+            size_mb = self._adapter_bytes(name) / 2**20
+            if size_mb > ADAPTER_MEMORY_BUDGET_MB:
+                self.model.delete_adapter(name)
+                raise ValueError(
+                    f"Adapter '{name}' needs {size_mb:.1f} MB, over the {ADAPTER_MEMORY_BUDGET_MB:.0f} MB budget"
+                )
+            self.register(name, path)
+            logger.info(f"Adapter {name} loaded ({size_mb:.1f} MB)")
+
+    def _check_capacity(self, name):
+        if name in self.adapters:
+            raise ValueError(f"Adapter '{name}' is already loaded")
+        if len(self.adapters) >= MAX_ADAPTERS:
+            raise ValueError(f"At most {MAX_ADAPTERS} adapters can be loaded at once")
+
+    def _estimate_bytes(self, local_path):
+        """Memory an adapter will take, from its config: r x (in + out) per targeted linear layer in float32"""
+        with open(os.path.join(local_path, "adapter_config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        rank = int(config.get("r", 8))
+        targets = config.get("target_modules") or []
+        saved = set(config.get("modules_to_save") or [])
+        parameters = 0
+        for module_name, module in self.model.named_modules():
+            leaf = module_name.rsplit(".", 1)[-1]
+            if isinstance(targets, str):
+                targeted = re.fullmatch(targets, module_name) is not None
+            else:
+                targeted = leaf in targets
+            if targeted and hasattr(module, "in_features"):
+                parameters += rank * (module.in_features + module.out_features)
+            elif leaf in saved:
+                # modules_to_save keeps a full trainable copy of the module
+                parameters += sum(parameter.numel() for parameter in module.parameters())
+        return parameters * 4
+
+    def unload(self, name):
+        if not self.multi:
+            raise ValueError("Adapters can only be unloaded when the server runs with EXTRACT_MULTI_ADAPTER=1")
+        if name == DEFAULT_ADAPTER:
+            raise ValueError("The default adapter cannot be unloaded")
+        with self.lock:
+            if name not in self.adapters:
+                raise KeyError(name)
+            self.model.delete_adapter(name)
+            del self.adapters[name]
+        logger.info(f"Adapter {name} unloaded")
+
+    def activate(self, name):
+        """Make an adapter the active one for the next generate() call; the caller holds ``lock``"""
+        if name not in self.adapters:
+            raise KeyError(f"Unknown adapter: {name}")
+        if self.multi:
+            self.model.set_adapter(name)
+
+    def has(self, name):
+        return name in self.adapters
+
+    def path(self, name):
+        adapter = self.adapters.get(name)
+        return adapter["path"] if adapter is not None else None
+
+    def prefix_cache(self, name):
+        return self.adapters[name]["prefix_cache"]
+
+    def _adapter_bytes(self, name):
+        return sum(
+            parameter.numel() * parameter.element_size()
+            for parameter_name, parameter in self.model.named_parameters()
+            if f".{name}." in parameter_name
+        )
+
+    def describe(self):
+        with self.lock:
+            return {
+                name: {
+                    "path": adapter["path"],
+                    "memory_mb": round(adapter["bytes"] / 2**20, 1),
+                    "loaded": adapter["loaded"],
+                }
+                for name, adapter in self.adapters.items()
+            }
+
+
+class PromptPrefixCache:
+    """past_key_values of the static instruction header, prefilled once and shared by every request"""
+
+    def __init__(self, model, tokenizer, prefix=PROMPT_PREFIX):
+        self.ids = tokenizer(prefix).input_ids
+        self.length = len(self.ids)
+        with torch.no_grad():
+            output = model(torch.tensor([self.ids], device=model.device), use_cache=True)
+        self.past_key_values = output.past_key_values
+
+    def matches(self, ids):
+        """True when a tokenized prompt starts with exactly the cached prefix tokens"""
+        return ids[:self.length] == self.ids
+
+    def expand(self, batch_size):
+        """Fresh copy of the cached keys/values for a batch, since generate() extends the cache in place"""
+        cache = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        return cache
+
+
+class FirstStepTimer(LogitsProcessor):
+    """Record when the first logits are produced, i.e. when prefill has finished"""
+
+    def __init__(self):
+        self.first_step = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_step is None:
+            self.first_step = time.perf_counter()
+        return scores
+
+
+class SpeculativeStats:
+    """Count main-model verification passes during assisted generation.
+
+    Assisted decoding has no separate prefill pass: the first forward sees the
+    uncached prompt tokens plus the first proposals, and every later pass the
+    last accepted token plus new proposals. Each pass yields the accepted
+    drafts plus one token of its own, so accepted drafts = generated tokens -
+    passes. The hook goes on the base model because a PeftModel's generate()
+    runs the wrapped model's forward, not its own.
+    """
+
+    def __init__(self, model, prompt_tokens):
+        # Tokens of the first pass that are prompt rather than proposals
+        self.prompt_tokens = prompt_tokens
+        self.passes = 0
+        self.proposed = 0
+        base_model = model.get_base_model() if hasattr(model, "get_base_model") else model
+        self.handle = base_model.register_forward_hook(self._hook, with_kwargs=True)
+
+    def _hook(self, module, args, kwargs, output):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        fed = self.prompt_tokens if self.passes == 0 else 1
+        self.passes += 1
+        self.proposed += max(0, input_ids.shape[1] - fed)
+
+    def remove(self):
+        self.handle.remove()
+
+    def record(self, generated):
+        accepted = min(max(0, generated - self.passes), self.proposed)
+        SPECULATIVE_STEPS.inc(self.passes)
+        SPECULATIVE_PROPOSED.inc(self.proposed)
+        SPECULATIVE_ACCEPTED.inc(accepted)
+        if self.proposed:
+            SPECULATIVE_ACCEPTANCE.observe(accepted / self.proposed)
+
+
+def generate_texts(prompts, streamer=None, adapter=DEFAULT_ADAPTER):
+    """Generate completions for a batch of prompts, returning prompt + completion for each.
+
+    When every prompt tokenizes to the cached instruction header followed by
+    its job-specific suffix, rows are laid out as ``[prefix][padding][suffix]``
+    so the shared prefix keys/values line up for the whole batch and only the
+    suffixes are prefilled. Otherwise prompts are left-padded as usual.
+    """
+    if SPECULATIVE_MODE != "off" and len(prompts) > 1:
+        # Assisted generation only supports a batch size of 1
+        return [output for prompt in prompts for output in generate_texts([prompt], streamer=streamer, adapter=adapter)]
+    
+    # Adapters cannot be switched, loaded or unloaded while a batch is generating
+    with adapter_registry.lock:
+        adapter_registry.activate(adapter)
+        return run_generate(prompts, streamer, adapter_registry.prefix_cache(adapter))
+
+
+def run_generate(prompts, streamer, prefix_cache):
+    """Tokenize, lay out and generate one batch with whichever adapter is active"""
+    model, tokenizer = generator.model, generator.tokenizer
+    
+    start = time.perf_counter()
+    encoded = [tokenizer(prompt).input_ids for prompt in prompts]
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="tokenize")
+    for ids in encoded:
+        INPUT_TOKENS.observe(len(ids))
+    BATCH_SIZE.observe(len(prompts))
     
-    base_model_path = "./Mistral-7B-Instruct-v0.2"
-    lora_model_path = "./mistral-job-extractor/checkpoint-200"
+    kwargs = {}
+    if prefix_cache is not None and all(prefix_cache.matches(ids) for ids in encoded):
+        head = prefix_cache.ids
+        tails = [ids[prefix_cache.length:] for ids in encoded]
+        kwargs["past_key_values"] = prefix_cache.expand(len(prompts))
+    else:
+        head = []
+        tails = encoded
     
+    width = max(len(tail) for tail in tails)
+    input_ids = []
+    attention_mask = []
+    for tail in tails:
+        padding = width - len(tail)
+        input_ids.append(head + [tokenizer.pad_token_id] * padding + tail)
+        attention_mask.append([1] * len(head) + [0] * padding + [1] * len(tail))
+    input_ids = torch.tensor(input_ids, device=model.device)
+    attention_mask = torch.tensor(attention_mask, device=model.device)
+    
+    kwargs.update(generation_kwargs(input_ids.shape[1]))
+    timer = FirstStepTimer()
+    kwargs["logits_processor"] = LogitsProcessorList(list(kwargs.get("logits_processor", [])) + [timer])
+    # The prefilled header is not fed to the first pass again
+    uncached = input_ids.shape[1] - (len(head) if "past_key_values" in kwargs else 0)
+    verification = SpeculativeStats(model, uncached) if SPECULATIVE_MODE != "off" else None
+    
+    start = time.perf_counter()
     try:
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=TEMPERATURE,
+                pad_token_id=tokenizer.pad_token_id,
+                streamer=streamer,
+                **kwargs,
+            )
+    finally:
+        if verification is not None:
+            verification.remove()
+    
+    end = time.perf_counter()
+    
+    new_tokens = output[:, input_ids.shape[1]:]
+    generated = (new_tokens != tokenizer.pad_token_id).sum(dim=1).tolist()
+    first_step = timer.first_step or end
+    STAGE_SECONDS.observe(first_step - start, stage="prefill")
+    STAGE_SECONDS.observe(end - first_step, stage="decode")
+    for count in generated:
+        GENERATED_TOKENS.observe(count)
+    if end > start:
+        TOKENS_PER_SECOND.observe(sum(generated) / (end - start))
+    if verification is not None:
+        verification.record(generated[0])
+    
+    completions = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    return [prompt + completion for prompt, completion in zip(prompts, completions)]
+
+
+def generation_kwargs(prompt_length):
+    """Per-call generate() arguments shared by batched and streamed extraction"""
+    kwargs = {}
+    if STOP_ON_JSON_CLOSE:
+        kwargs["stopping_criteria"] = StoppingCriteriaList([JsonObjectStoppingCriteria(generator.tokenizer, prompt_length)])
+    if CONSTRAINED_DECODING:
+        kwargs["logits_processor"] = LogitsProcessorList([SchemaLogitsProcessor(schema_vocabulary, prompt_length)])
+    if SPECULATIVE_MODE == "prompt_lookup":
+        kwargs["prompt_lookup_num_tokens"] = PROMPT_LOOKUP_TOKENS
+    elif SPECULATIVE_MODE == "draft":
+        kwargs["assistant_model"] = draft_model
+    return kwargs
+
+
+def trim_response(prompt, response):
+    """Drop anything generated after the extracted JSON object closes"""
+    if not STOP_ON_JSON_CLOSE:
+        return response
+    prefix = prompt if response.startswith(prompt) else ""
+    completion = response[len(prefix):]
+    end = JsonObjectScanner().feed(completion)
+    return response if end is None else prefix + completion[:end]
+
+
+class LinkedFuture(Future):
+    """Future completed from other futures, reporting running while any of them runs"""
+
+    def __init__(self):
+        super().__init__()
+        self.sources = []
+
+    def running(self):
+        return not self.done() and any(source.running() for source in self.sources)
+
+    def follow(self, source):
+        """Complete with source's result or exception"""
+        self.sources = [source]
         
-        logger.info("Loading tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(base_model_path)
-        tokenizer.pad_token = tokenizer.eos_token
+        def copy_outcome(done):
+            if done.exception() is not None:
+                self.set_exception(done.exception())
+            else:
+                self.set_result(done.result())
         
+        source.add_done_callback(copy_outcome)
+
+
+class SingleFlight:
+    """Coalesce concurrent identical extractions onto one in-flight Future, keyed by content hash"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, start):
+        """Return (future, leader); start() is only called when no identical extraction is in flight.
+
+        start() runs outside the lock, so one leader's pre-processing does not
+        hold up requests for other postings. Its exceptions are delivered
+        through the future, to the leader and followers alike.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                COALESCED_REQUESTS.inc()
+                return future, False
+            future = LinkedFuture()
+            self.calls[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        try:
+            future.follow(start())
+        except Exception as e:
+            future.set_exception(e)
+        return future, True
+
+    def _forget(self, key, done):
+        with self.lock:
+            if self.calls.get(key) is done:
+                del self.calls[key]
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+
+class BatchQueue:
+    """Collect pending extraction prompts and run them through the generator as one padded batch"""
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, prompt, streamer=None, adapter=DEFAULT_ADAPTER):
+        """Queue a prompt and return a Future that resolves to its generated text.
+
+        When a streamer is given the prompt is generated on its own, since the
+        transformers streamers only support a batch size of 1.
+        """
+        future = Future()
+        self.pending.put((prompt, streamer, future, time.perf_counter(), adapter))
+        return future
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Mark futures as running so job status can report it; drop cancelled ones
+            batch = [item for item in self._collect() if item[2].set_running_or_notify_cancel()]
+            picked = time.perf_counter()
+            for item in batch:
+                QUEUE_WAIT_SECONDS.observe(picked - item[3])
+            
+            # Each generate() call runs a single adapter
+            by_adapter = OrderedDict()
+            for prompt, streamer, future, _, adapter in batch:
+                if streamer is None:
+                    by_adapter.setdefault(adapter, []).append((prompt, future))
+            for adapter, items in by_adapter.items():
+                self._generate_batch(items, adapter)
+            for prompt, streamer, future, _, adapter in batch:
+                if streamer is not None:
+                    self._generate_streamed(prompt, streamer, future, adapter)
+
+    def _generate_batch(self, batch, adapter):
+        prompts = [prompt for prompt, _ in batch]
+        try:
+            logger.info(f"Running extraction batch of size {len(prompts)} with adapter {adapter}")
+            outputs = generate_texts(prompts, adapter=adapter)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (prompt, future), output in zip(batch, outputs):
+            future.set_result(trim_response(prompt, output))
+
+    def _generate_streamed(self, prompt, streamer, future, adapter):
+        try:
+            logger.info(f"Running streamed extraction with adapter {adapter}")
+            output = generate_texts([prompt], streamer=streamer, adapter=adapter)[0]
+        except Exception as e:
+            # Unblock the consumer iterating over the streamer
+            streamer.end()
+            future.set_exception(e)
+            return
+        future.set_result(trim_response(prompt, output))
+
+
+def build_prompt(job_title, company, job_description):
+    """Build the extraction prompt for a single job posting"""
+    return PROMPT_PREFIX + f"""Job Title: {job_title}
+Company: {company}
+Job Description:
+{job_description}
+"""
+
+# Sentences matching any of these are legal or recruiting boilerplate with nothing to extract
+BOILERPLATE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"equal (employment )?opportunity",
+    r"\bEEO\b",
+    r"affirmative action",
+    r"without regard to (race|age|sex|gender|religion|color)",
+    r"reasonable accommodations?",
+    r"\bE-Verify\b",
+    r"privacy (notice|policy)",
+    r"(fair chance|background check|drug[- ]free)",
+    r"do not (accept|forward) unsolicited",
+    r"recruitment agenc(y|ies)",
+    r"all rights reserved",
+    r"^(apply now|share this job|save job|report this job)\.?$",
+)]
+
+# Section headers in ranking order; paragraphs inherit the rank of the header above them
+SECTION_RANKS = [
+    (0, re.compile(r"requirement|qualification|skill|must have|what you (need|bring|have)|who you are|you have", re.IGNORECASE)),
+    (0, re.compile(r"education|degree|experience", re.IGNORECASE)),
+    (1, re.compile(r"responsibilit|duties|what you('ll| will) do|the role|your role|day[- ]to[- ]day", re.IGNORECASE)),
+    (1, re.compile(r"preferred|nice to have|bonus|plus", re.IGNORECASE)),
+    (2, re.compile(r"salary|compensation|pay|benefit|perks|what we offer", re.IGNORECASE)),
+    (4, re.compile(r"about (us|the company|the team)|who we are|our (mission|culture|story|values)|company overview", re.IGNORECASE)),
+]
+UNSECTIONED_RANK = 3
+# Rank of the requirements, qualifications, skills and education sections
+REQUIREMENTS_RANK = 0
+
+# Paragraphs at least this share boilerplate (by characters) are dropped whole
+BOILERPLATE_SHARE = 0.5
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text):
+    return len(generator.tokenizer(text, add_special_tokens=False).input_ids)
+
+
+def split_paragraphs(job_description):
+    """Collapse repeated whitespace and split into paragraphs, dropping exact repeats.
+
+    Returns ``(paragraphs, separator)``, the separator being what rejoins them
+    without adding blank lines the posting did not have.
+    """
+    lines = [" ".join(line.split()) for line in job_description.splitlines()]
+    paragraphs = [paragraph.strip() for paragraph in "\n".join(lines).split("\n\n")]
+    separator = "\n\n"
+    if len(paragraphs) == 1:
+        # Scraped postings often lose their blank lines; fall back to single lines
+        paragraphs = lines
+        separator = "\n"
+    seen = set()
+    unique = []
+    for paragraph in paragraphs:
+        if paragraph and paragraph.lower() not in seen:
+            seen.add(paragraph.lower())
+            unique.append(paragraph)
+    return unique, separator
+
+
+def section_rank(paragraph):
+    """Rank of the section a header paragraph opens, or None for body text.
+
+    A header ends in ":" or is a short unpunctuated line naming a known
+    section; other short lines (e.g. an unbulleted "SQL and Spark") are body
+    text and stay in the current section.
+    """
+    first_line = paragraph.split("\n", 1)[0]
+    for rank, pattern in SECTION_RANKS:
+        if pattern.search(first_line) and (first_line.endswith(":") or (
+            len(first_line.split()) <= 5 and not first_line.endswith((".", ",", ";")) and first_line[0] not in "-*•"
+        )):
+            return rank
+    return UNSECTIONED_RANK if first_line.endswith(":") else None
+
+
+def strip_boilerplate(paragraphs):
+    """Remove boilerplate sentences, and whole paragraphs that are mostly boilerplate.
+
+    Everything in a requirements section is kept verbatim, since "must pass a
+    background check" is a requirement there.
+    """
+    kept = []
+    rank = UNSECTIONED_RANK
+    for paragraph in paragraphs:
+        header = section_rank(paragraph)
+        rank = rank if header is None else header
+        if rank == REQUIREMENTS_RANK:
+            kept.append(paragraph)
+            continue
+        
+        lines = []
+        removed = 0
+        for line in paragraph.split("\n"):
+            sentences = SENTENCE_BOUNDARY.split(line)
+            clean = [sentence for sentence in sentences if not any(p.search(sentence) for p in BOILERPLATE_PATTERNS)]
+            removed += sum(len(sentence) for sentence in sentences) - sum(len(sentence) for sentence in clean)
+            if clean:
+                lines.append(" ".join(clean))
+        if not removed:
+            kept.append(paragraph)
+        elif lines and removed < BOILERPLATE_SHARE * len(paragraph):
+            kept.append("\n".join(lines))
+    return kept
+
+
+def prepare_description(job_description):
+    """Clean a job description and fit it to the token budget.
+
+    Returns ``(chunks, tokens_removed)``: a single cleaned description, or
+    several budget-sized chunks in document order when even the cleaned text
+    is over the map-reduce threshold.
+    """
+    original_tokens = count_tokens(job_description)
+    paragraphs, separator = split_paragraphs(job_description)
+    if STRIP_BOILERPLATE:
+        paragraphs = strip_boilerplate(paragraphs)
+    
+    sizes = [count_tokens(p) for p in paragraphs]
+    if INPUT_TOKEN_BUDGET <= 0 or sum(sizes) <= INPUT_TOKEN_BUDGET:
+        kept = [paragraphs]
+    elif MAP_REDUCE_TOKENS > 0 and sum(sizes) > MAP_REDUCE_TOKENS:
+        kept = chunk_paragraphs(paragraphs, sizes, separator)
+    else:
+        kept = [rank_paragraphs(paragraphs, sizes)]
+    
+    chunks = [separator.join(chunk) for chunk in kept]
+    removed = original_tokens - sum(count_tokens(chunk) for chunk in chunks)
+    return chunks, max(removed, 0)
+
+
+def paragraph_ranks(paragraphs):
+    """Rank of every paragraph: that of the section header above it"""
+    ranks = []
+    rank = UNSECTIONED_RANK
+    for paragraph in paragraphs:
+        header = section_rank(paragraph)
+        rank = rank if header is None else header
+        ranks.append(rank)
+    return ranks
+
+
+def select_by_rank(indices, ranks, sizes, budget):
+    """The best ranked of indices that fit the budget, in their original order"""
+    keep = set()
+    used = 0
+    for index in sorted(indices, key=lambda i: (ranks[i], i)):
+        if used + sizes[index] <= budget:
+            keep.add(index)
+            used += sizes[index]
+    return [index for index in indices if index in keep]
+
+
+def rank_paragraphs(paragraphs, sizes, budget=None):
+    """Keep the best ranked paragraphs that fit the budget, in their original order"""
+    budget = INPUT_TOKEN_BUDGET if budget is None else budget
+    indices = select_by_rank(range(len(paragraphs)), paragraph_ranks(paragraphs), sizes, budget)
+    return [paragraphs[index] for index in indices]
+
+
+def pack_chunks(indices, sizes):
+    """Greedily pack paragraph indices, in order, into budget-sized chunks"""
+    chunks = [[]]
+    used = 0
+    for index in indices:
+        if chunks[-1] and used + sizes[index] > INPUT_TOKEN_BUDGET:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(index)
+        used += sizes[index]
+    return chunks
+
+
+def chunk_paragraphs(paragraphs, sizes, separator="\n\n"):
+    """Pack paragraphs into at most MAX_CHUNKS budget-sized chunks, dropping the lowest ranked overflow.
+
+    Greedy packing can need more chunks than the token total suggests, so the
+    lowest ranked paragraph (the later one on ties) is dropped and the rest
+    repacked until the chunks fit; what is kept stays in document order.
+    """
+    ranks = paragraph_ranks(paragraphs)
+    indices = select_by_rank(range(len(paragraphs)), ranks, sizes, INPUT_TOKEN_BUDGET * MAX_CHUNKS)
+    chunks = pack_chunks(indices, sizes)
+    while len(chunks) > MAX_CHUNKS:
+        indices.remove(max(indices, key=lambda i: (ranks[i], i)))
+        chunks = pack_chunks(indices, sizes)
+    
+    chunks = [[paragraphs[index] for index in chunk] for chunk in chunks]
+    # A single paragraph over the budget still has to be cut down
+    return [chunk if sum(count_tokens(p) for p in chunk) <= INPUT_TOKEN_BUDGET
+            else truncate_tokens(chunk, separator) for chunk in chunks]
+
+
+def truncate_tokens(chunk, separator="\n\n"):
+    tokenizer = generator.tokenizer
+    ids = tokenizer(separator.join(chunk), add_special_tokens=False).input_ids[:INPUT_TOKEN_BUDGET]
+    return [tokenizer.decode(ids, skip_special_tokens=True)]
+
+
+def parse_extraction(prompt, response):
+    """Parse the JSON object generated after the prompt, or None if it is not valid JSON"""
+    completion = response[len(prompt):] if response.startswith(prompt) else response
+    start = completion.find("{")
+    if start < 0:
+        return None
+    end = JsonObjectScanner().feed(completion[start:])
+    try:
+        parsed = json.loads(completion[start:] if end is None else completion[start:start + end])
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def merge_extractions(results):
+    """Merge per-chunk extraction objects key by key, skipping "N/A" and repeated values"""
+    merged = {}
+    for key in EXTRACTION_KEYS:
+        values = []
+        for result in results:
+            value = result.get(key)
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                if isinstance(item, dict):
+                    item = "; ".join(f"{k}: {v}" for k, v in item.items())
+                if item is None or str(item).strip() in ("", "N/A") or item in values:
+                    continue
+                values.append(item)
+        if not values:
+            merged[key] = "N/A"
+        elif len(values) == 1 and not any(isinstance(result.get(key), list) for result in results):
+            merged[key] = values[0]
+        else:
+            merged[key] = values
+    return merged
+
+BENCHMARK_DESCRIPTION = """We are looking for a Data Analyst to join our analytics team.
+Responsibilities include building dashboards, writing SQL queries against our data warehouse and presenting insights to stakeholders.
+Requirements: Bachelor's degree in a quantitative field, 2+ years of experience with SQL and Python, familiarity with Tableau or PowerBI.
+Nice to have: experience with A/B testing and cloud data platforms.
+Salary: $60,000 - $80,000 per year.
+"""
+
+def run_benchmark(runs):
+    """Time sequential single-request extractions of a sample posting and log decode throughput"""
+    load_model()
+    tokenizer = generator.tokenizer
+    prompt = build_prompt("Data Analyst", "Example Corp", BENCHMARK_DESCRIPTION)
+    prompt_tokens = len(tokenizer(prompt).input_ids)
+    
+    logger.info("Warming up...")
+    generate_texts([prompt])
+    
+    total_tokens = 0
+    total_seconds = 0.0
+    for run in range(runs):
+        start = time.perf_counter()
+        output = generate_texts([prompt])[0]
+        elapsed = time.perf_counter() - start
+        new_tokens = len(tokenizer(output).input_ids) - prompt_tokens
+        total_tokens += new_tokens
+        total_seconds += elapsed
+        logger.info(f"Run {run + 1}/{runs}: {new_tokens} tokens in {elapsed:.2f}s ({new_tokens / elapsed:.1f} tokens/sec)")
+    
+    logger.info(f"Benchmark ({BACKEND} backend): {total_tokens / total_seconds:.1f} tokens/sec over {runs} runs")
+
+def load_tokenizer(path):
+    """Load the tokenizer configured for batched generation"""
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models must be left-padded for batched generation
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+def physical_core_count():
+    """Number of physical CPU cores, falling back to logical cores when psutil is unavailable"""
+    try:
+        import psutil
+        count = psutil.cpu_count(logical=False)
+        if count:
+            return count
+    except ImportError:
+        pass
+    return os.cpu_count() or 1
+
+def load_base_model(base_model_path=BASE_MODEL_PATH):
+    """Load the base model for the selected backend.
+
+    The CUDA backend quantizes to 4-bit while loading; the CPU backend keeps
+    float32 weights here and is quantized afterwards by quantize_for_cpu().
+    """
+    logger.info("Loading base model...")
+    if BACKEND == "cpu":
+        base_model = AutoModelForCausalLM.from_pretrained(
+            base_model_path,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True,
+        )
+    else:
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_use_double_quant=True,
             bnb_4bit_quant_type="nf4",
             bnb_4bit_compute_dtype=torch.float16,
         )
-        
-        logger.info("Loading base model...")
         base_model = AutoModelForCausalLM.from_pretrained(
             base_model_path,
             quantization_config=bnb_config,
             device_map="auto",
             trust_remote_code=True,
         )
+    return base_model
+
+def build_merged_model(base_model_path=BASE_MODEL_PATH, lora_model_path=LORA_MODEL_PATH):
+    """Load the base model, apply the LoRA adapter and merge it in"""
+    base_model = load_base_model(base_model_path)
+    
+    logger.info("Loading adapter weights...")
+    model = PeftModel.from_pretrained(base_model, lora_model_path)
+    
+    logger.info("Merging adapter with base model...")
+    return model.merge_and_unload()
+
+def quantize_for_cpu(model):
+    """Apply dynamic int8 quantization to the Linear layers and size the thread pool to the physical cores"""
+    threads = CPU_THREADS or physical_core_count()
+    torch.set_num_threads(threads)
+    logger.info(f"Quantizing Linear layers to int8 for CPU inference with {threads} threads...")
+    model.eval()
+    # In place: a quantized copy would briefly double peak RAM on the small boxes this backend targets
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def export_merged_model(output_dir):
+    """Save the merged model and tokenizer as a single safetensors artifact for fast startup.
+
+    For the CUDA backend the artifact already holds the 4-bit weights. Dynamic
+    int8 modules cannot be serialized, so the CPU backend stores the merged
+    weights in bfloat16 and quantizes them when the server loads them.
+    The artifact is written to a temporary directory and renamed into place,
+    so an interrupted export never leaves a partial model at output_dir.
+    """
+    start = time.perf_counter()
+    tokenizer = load_tokenizer(BASE_MODEL_PATH)
+    model = build_merged_model()
+    if BACKEND == "cpu":
+        model = model.to(torch.bfloat16)
+    
+    output_dir = output_dir.rstrip("/\\")
+    temporary_dir = output_dir + ".tmp"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    logger.info(f"Saving merged model to {temporary_dir}...")
+    model.save_pretrained(temporary_dir, safe_serialization=True, max_shard_size="1000GB")
+    tokenizer.save_pretrained(temporary_dir)
+    with open(os.path.join(temporary_dir, "export_info.json"), "w", encoding="utf-8") as f:
+        json.dump({"base_model": BASE_MODEL_PATH, "adapter": LORA_MODEL_PATH, "backend": BACKEND}, f, indent=2)
+    
+    previous_dir = output_dir + ".old"
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    if os.path.exists(output_dir):
+        os.replace(output_dir, previous_dir)
+    os.replace(temporary_dir, output_dir)
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    logger.info(f"Export completed in {time.perf_counter() - start:.1f}s")
+
+def read_export_info(path):
+    """Return the export metadata of a merged model directory, or None if there is no usable artifact.
+
+    export_info.json is written last by --export, so a directory without it
+    is an incomplete export (or not one at all) and is ignored.
+    """
+    if not path or not os.path.isdir(path):
+        return None
+    export_info_path = os.path.join(path, "export_info.json")
+    if not os.path.exists(export_info_path):
+        logger.info(f"Ignoring {path}: it has no export_info.json")
+        return None
+    with open(export_info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_exported_model(path):
+    """Load the tokenizer and merged model saved by export_merged_model()"""
+    logger.info(f"Loading pre-merged model from {path}...")
+    tokenizer = load_tokenizer(path)
+    # The safetensors file is memory-mapped and already holds the merged weights
+    if BACKEND == "cpu":
+        model = AutoModelForCausalLM.from_pretrained(
+            path,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True,
+        )
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            path,
+            device_map="auto",
+            low_cpu_mem_usage=True,
+        )
+    return tokenizer, model
+
+def load_model():
+    """Load the model and tokenizer once when the server starts"""
+    global generator, batch_queue, extraction_cache, schema_vocabulary, adapter_registry, job_store, single_flight
+    global model_source, startup_seconds, draft_model
+    
+    start = time.perf_counter()
+    
+    try:
         
-        logger.info("Loading adapter weights...")
-        model = PeftModel.from_pretrained(base_model, lora_model_path)
+        if MULTI_ADAPTER and BACKEND == "cpu":
+            raise ValueError("EXTRACT_MULTI_ADAPTER is not supported with the CPU backend")
         
-        logger.info("Merging adapter with base model...")
-        model = model.merge_and_unload()
+        export_info = None if MULTI_ADAPTER else read_export_info(MERGED_MODEL_PATH)
+        if export_info is not None and export_info.get("backend", "cuda") != BACKEND:
+            logger.info(f"Ignoring {MERGED_MODEL_PATH}: it was exported for the {export_info.get('backend')} backend")
+            export_info = None
+        
+        if MULTI_ADAPTER:
+            logger.info("Loading tokenizer...")
+            tokenizer = load_tokenizer(BASE_MODEL_PATH)
+            logger.info("Loading default adapter without merging...")
+            model = PeftModel.from_pretrained(load_base_model(), LORA_MODEL_PATH, adapter_name=DEFAULT_ADAPTER)
+            model_source = f"{BASE_MODEL_PATH}|multi-adapter"
+        else:
+            model = None
+            if export_info is not None:
+                try:
+                    tokenizer, model = load_exported_model(MERGED_MODEL_PATH)
+                    model_source = f"{export_info['base_model']}|{export_info['adapter']}"
+                except Exception as e:
+                    logger.warning(f"Could not load {MERGED_MODEL_PATH} ({str(e)}); merging the adapter instead")
+                    model = None
+            if model is None:
+                logger.info("Loading tokenizer...")
+                tokenizer = load_tokenizer(BASE_MODEL_PATH)
+                model = build_merged_model()
+                model_source = f"{BASE_MODEL_PATH}|{LORA_MODEL_PATH}"
+        
+        if BACKEND == "cpu":
+            model = quantize_for_cpu(model)
         
         logger.info("Creating pipeline...")
         generator = pipeline(
             "text-generation",
             model=model,
             tokenizer=tokenizer,
-            max_new_tokens=512,
-            temperature=0.2,
+            max_new_tokens=MAX_NEW_TOKENS,
+            temperature=TEMPERATURE,
         )
         
-        logger.info("Model loaded successfully!")
+        adapter_registry = AdapterRegistry(model, tokenizer, MULTI_ADAPTER)
+        adapter_registry.register(DEFAULT_ADAPTER, LORA_MODEL_PATH)
+        
+        if SPECULATIVE_MODE == "draft":
+            if not DRAFT_MODEL_PATH:
+                raise ValueError("EXTRACT_SPECULATIVE=draft requires EXTRACT_DRAFT_MODEL_PATH")
+            logger.info(f"Loading draft model from {DRAFT_MODEL_PATH}...")
+            # The draft model must share the Mistral tokenizer
+            draft_model = AutoModelForCausalLM.from_pretrained(
+                DRAFT_MODEL_PATH,
+                torch_dtype=torch.float32 if BACKEND == "cpu" else torch.float16,
+                device_map=None if BACKEND == "cpu" else "auto",
+                low_cpu_mem_usage=True,
+            )
+        if SPECULATIVE_MODE != "off":
+            logger.info(f"Speculative decoding enabled ({SPECULATIVE_MODE}); requests are generated one at a time")
+        
+        if CONSTRAINED_DECODING:
+            logger.info("Building constrained decoding vocabulary...")
+            schema_vocabulary = SchemaVocabulary(tokenizer)
+        
+        extraction_cache = ExtractionCache()
+        single_flight = SingleFlight()
+        batch_queue = BatchQueue()
+        job_store = JobStore()
+        logger.info(f"Batching up to {batch_queue.max_batch_size} requests, waiting at most {MAX_BATCH_WAIT_MS} ms")
+        
+        startup_seconds = time.perf_counter() - start
+        logger.info(f"Model loaded successfully in {startup_seconds:.1f}s!")
         
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         raise e
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe request latency per route (streamed bodies are timed up to their first byte)"""
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request, stage, token and cache metrics"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    
+    if extraction_cache is not None:
+        stats = extraction_cache.stats()
+        lines.append("# HELP extractor_cache_hits_total Extraction cache hits by tier.")
+        lines.append("# TYPE extractor_cache_hits_total counter")
+        lines.append(f'extractor_cache_hits_total{{tier="memory"}} {stats["memory_hits"]}')
+        lines.append(f'extractor_cache_hits_total{{tier="disk"}} {stats["disk_hits"]}')
+        lines.append("# HELP extractor_cache_misses_total Extraction cache misses.")
+        lines.append("# TYPE extractor_cache_misses_total counter")
+        lines.append(f"extractor_cache_misses_total {stats['misses']}")
+    
+    if batch_queue is not None:
+        lines.append("# HELP extractor_queue_depth Prompts waiting for the batch worker.")
+        lines.append("# TYPE extractor_queue_depth gauge")
+        lines.append(f"extractor_queue_depth {batch_queue.pending.qsize()}")
+
+    if single_flight is not None:
+        lines.append("# HELP extractor_in_flight_extractions Distinct extractions currently generating or queued.")
+        lines.append("# TYPE extractor_in_flight_extractions gauge")
+        lines.append(f"extractor_in_flight_extractions {single_flight.in_flight()}")
+    
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
-        "model_loaded": generator is not None
+        "model_loaded": generator is not None,
+        "backend": BACKEND,
+        "speculative": SPECULATIVE_MODE,
+        "adapters": sorted(adapter_registry.adapters) if adapter_registry is not None else [],
+        "startup_seconds": startup_seconds,
+        "cache": extraction_cache.stats() if extraction_cache is not None else None,
+        "jobs": job_store.stats() if job_store is not None else None
     })
 
-@app.route('/extract', methods=['GET'])
+class JobStore:
+    """Bounded registry of asynchronous extraction jobs.
+
+    Jobs are fed to the same batch worker as synchronous requests. At most
+    ``max_pending`` jobs may be queued or running at once; finished jobs are
+    kept for ``result_ttl`` seconds so clients can poll for the result.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_JOBS, result_ttl=JOB_RESULT_TTL):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, job_title, company, job_description, adapter=DEFAULT_ADAPTER):
+        """Register a job and start its extraction; raises queue.Full when the store is at capacity"""
+        with self.lock:
+            self._expire()
+            if self.pending >= self.max_pending:
+                raise queue.Full()
+            self.pending += 1
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id,
+                "job_title": job_title,
+                "company": company,
+                "submitted": time.time(),
+                "finished": None,
+                "future": None,
+            }
+            self.jobs[job_id] = job
+        
+        try:
+            job["future"], _ = submit_extraction(job_title, company, job_description, adapter)
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+                del self.jobs[job_id]
+            raise
+        job["future"].add_done_callback(lambda done: self._finish(job))
+        return job_id
+
+    def _finish(self, job):
+        with self.lock:
+            self.pending -= 1
+            job["finished"] = time.time()
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job["finished"] is not None and job["finished"] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        """Describe a job for the polling endpoint, or return None if it is unknown or expired"""
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        
+        future = job["future"]
+        description = {"id": job_id, "submitted": job["submitted"]}
+        if future is None or not (future.running() or future.done()):
+            description["status"] = "queued"
+        elif future.running():
+            description["status"] = "running"
+        elif future.exception() is not None:
+            description["status"] = "failed"
+            description["error"] = f"An error occurred during extraction: {str(future.exception())}"
+        else:
+            prompt, response = future.result()
+            description["status"] = "completed"
+            description["result"] = {
+                "success": True,
+                "prompt": prompt,
+                "response": response,
+                "job_title": job["job_title"],
+                "company": job["company"]
+            }
+        return description
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "retained": len(self.jobs),
+            }
+
+def read_job_params():
+    """Read the job posting fields from the JSON body (POST) or the query string (GET)"""
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+    else:
+        params = request.args
+    return (
+        str(params.get('job_title', '') or ''),
+        str(params.get('company', '') or ''),
+        str(params.get('job_description', '') or ''),
+    )
+
+def read_adapter():
+    """Adapter requested with ?adapter= (or an "adapter" field in a JSON body)"""
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    if isinstance(body, dict) and body.get('adapter'):
+        return str(body['adapter'])
+    return request.args.get('adapter', DEFAULT_ADAPTER)
+
+def unknown_adapter_response(adapter):
+    return jsonify({
+        "error": f"Unknown adapter: {adapter}"
+    }), 404
+
+def prepare_prompts(job_title, company, job_description):
+    """Return (prompt, chunk_prompts) for a posting; chunk_prompts is None unless it is map-reduced"""
+    start = time.perf_counter()
+    chunks, removed = prepare_description(job_description)
+    INPUT_TOKENS_REMOVED.observe(removed)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="preprocess")
+    if removed:
+        logger.info(f"Pre-processing removed {removed} job description tokens")
+    
+    start = time.perf_counter()
+    prompt = build_prompt(job_title, company, "\n\n".join(chunks))
+    chunk_prompts = None
+    if len(chunks) > 1:
+        MAP_REDUCE_CHUNKS.observe(len(chunks))
+        chunk_prompts = [build_prompt(job_title, company, chunk) for chunk in chunks]
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="prompt_build")
+    return prompt, chunk_prompts
+
+def submit_extraction(job_title, company, job_description, adapter=DEFAULT_ADAPTER, streamer=None):
+    """Start an extraction and return (Future of (prompt, response), source).
+
+    source is "cache", "coalesced" or "generated". The cache and the
+    in-flight generations are checked on the raw posting first, so only the
+    request that actually generates pays for pre-processing and prompt
+    building. A streamer is only fed when source is "generated".
+    """
+    key = cache_key(job_title, company, job_description, adapter)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future, "cache"
+    
+    # Identical requests already in flight share that generation
+    future, leader = single_flight.run(
+        key, lambda: start_generation(key, job_title, company, job_description, adapter, streamer)
+    )
+    return future, "generated" if leader else "coalesced"
+
+def start_generation(key, job_title, company, job_description, adapter, streamer=None):
+    """Build the prompt (or chunk prompts), queue it for the batch worker and cache the result when it completes"""
+    try:
+        prompt, chunk_prompts = prepare_prompts(job_title, company, job_description)
+    except Exception:
+        if streamer is not None:
+            streamer.end()
+        raise
+    
+    # Generated alongside any other requests queued in the same window
+    if chunk_prompts is None:
+        generation = batch_queue.submit(prompt, streamer=streamer, adapter=adapter)
+        sources = [generation]
+    else:
+        # Map-reduced postings are generated in batches, so there are no tokens to stream
+        if streamer is not None:
+            streamer.end()
+        sources = [batch_queue.submit(chunk_prompt, adapter=adapter) for chunk_prompt in chunk_prompts]
+        generation = reduce_chunks(prompt, chunk_prompts, sources)
+    
+    result = LinkedFuture()
+    result.sources = sources
+    
+    def store(done):
+        if done.exception() is not None:
+            result.set_exception(done.exception())
+            return
+        extraction_cache.put(key, prompt, done.result())
+        result.set_result((prompt, done.result()))
+    
+    generation.add_done_callback(store)
+    return result
+
+def reduce_chunks(prompt, chunk_prompts, futures):
+    """Return a Future for the key-by-key merge of the per-chunk extractions"""
+    reduced = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+    
+    def chunk_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            results = [parse_extraction(chunk_prompt, future.result()) for chunk_prompt, future in zip(chunk_prompts, futures)]
+        except Exception as e:
+            reduced.set_exception(e)
+            return
+        results = [result for result in results if result is not None]
+        if not results:
+            reduced.set_exception(ValueError("No chunk produced a valid JSON extraction"))
+            return
+        reduced.set_result(prompt + json.dumps(merge_extractions(results), indent=2))
+    
+    for future in futures:
+        future.add_done_callback(chunk_done)
+    return reduced
+
+@app.route('/extract', methods=['GET', 'POST'])
 def extract_job_info():
     """Extract job information from job description"""
     try:
-        if generator is None:
+        if generator is None or batch_queue is None:
             return jsonify({
                 "error": "Model not loaded. Please wait for the server to initialize."
             }), 503
         
-        job_title = request.args.get('job_title', '')
-        company = request.args.get('company', '')
-        job_description = request.args.get('job_description', '')
+        job_title, company, job_description = read_job_params()
+        adapter = read_adapter()
         
         if not job_description.strip():
             return jsonify({
                 "error": "job_description parameter is required"
             }), 400
-        
-        prompt = f"""### Instruction:
-Extract the following information from the job description in a structured JSON format.
-The JSON should have exactly these keys: "Core Responsibilities", "Required Skills", "Educational Requirements", "Experience Level", "Preferred Qualifications", "Compensation and Benefits".
-If information for a key is not present, use "N/A".
-
-Job Title: {job_title}
-Company: {company}
-Job Description:
-{job_description}
-"""
+        if not adapter_registry.has(adapter):
+            return unknown_adapter_response(adapter)
         
         logger.info("Processing job extraction request...")
         
-        # Generate response
-        response = generator(prompt)[0]["generated_text"]
+        future, _ = submit_extraction(job_title, company, job_description, adapter)
+        prompt, response = future.result()
         
         logger.info("Job extraction completed successfully")
         
-        return jsonify({
+        start = time.perf_counter()
+        body = jsonify({
             "success": True,
             "prompt": prompt,
             "response": response,
             "job_title": job_title,
             "company": company
         })
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="serialize")
+        return body
         
     except Exception as e:
         logger.error(f"Error during extraction: {str(e)}")
@@ -120,6 +1817,281 @@ Job Description:
             "error": f"An error occurred during extraction: {str(e)}"
         }), 500
 
+@app.route('/extract/batch', methods=['POST'])
+def extract_job_info_batch():
+    """Extract job information for a list of postings, returning results in request order.
+
+    Accepts ``{"postings": [{"job_title": ..., "company": ..., "job_description": ...}, ...]}``
+    (or a bare list). Every posting is queued before any result is awaited so
+    the batch worker can generate them together.
+    """
+    if generator is None or batch_queue is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    body = request.get_json(silent=True)
+    postings = body.get('postings') if isinstance(body, dict) else body
+    if not isinstance(postings, list) or not postings:
+        return jsonify({
+            "error": "Request body must be a non-empty list of postings"
+        }), 400
+    if len(postings) > MAX_BULK_POSTINGS:
+        return jsonify({
+            "error": f"At most {MAX_BULK_POSTINGS} postings are accepted per request"
+        }), 413
+    
+    default_adapter = read_adapter()
+    
+    logger.info(f"Processing batch extraction request with {len(postings)} postings...")
+    
+    pending = []
+    for posting in postings:
+        if not isinstance(posting, dict):
+            pending.append(("", "", None, "Each posting must be a JSON object"))
+            continue
+        job_title = str(posting.get('job_title', '') or '')
+        company = str(posting.get('company', '') or '')
+        job_description = str(posting.get('job_description', '') or '')
+        adapter = str(posting.get('adapter') or default_adapter)
+        if not job_description.strip():
+            pending.append((job_title, company, None, "job_description is required"))
+            continue
+        if not adapter_registry.has(adapter):
+            pending.append((job_title, company, None, f"Unknown adapter: {adapter}"))
+            continue
+        pending.append((job_title, company, submit_extraction(job_title, company, job_description, adapter)[0], None))
+    
+    results = []
+    for job_title, company, submitted, error in pending:
+        if submitted is not None:
+            try:
+                prompt, response = submitted.result()
+                results.append({
+                    "success": True,
+                    "prompt": prompt,
+                    "response": response,
+                    "job_title": job_title,
+                    "company": company
+                })
+                continue
+            except Exception as e:
+                logger.error(f"Error during batch extraction: {str(e)}")
+                error = f"An error occurred during extraction: {str(e)}"
+        results.append({
+            "success": False,
+            "error": error,
+            "job_title": job_title,
+            "company": company
+        })
+    
+    logger.info("Batch extraction completed")
+    
+    return jsonify({
+        "success": True,
+        "results": results
+    })
+
+@app.route('/extract/stream', methods=['GET', 'POST'])
+def extract_job_info_stream():
+    """Extract job information, streaming generated text as Server-Sent Events.
+
+    Emits ``data: {"token": ...}`` messages while decoding, then a final
+    ``done`` event with the same payload as ``/extract`` (or an ``error`` event).
+    """
+    if generator is None or batch_queue is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    job_title, company, job_description = read_job_params()
+    adapter = read_adapter()
+    
+    if not job_description.strip():
+        return jsonify({
+            "error": "job_description parameter is required"
+        }), 400
+    if not adapter_registry.has(adapter):
+        return unknown_adapter_response(adapter)
+    
+    logger.info("Processing streamed job extraction request...")
+    
+    def events():
+        try:
+            streamer = TextIteratorStreamer(generator.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            future, source = submit_extraction(job_title, company, job_description, adapter, streamer)
+            streamed = False
+            if source == "generated":
+                # Ended without tokens when the posting is map-reduced
+                for token in streamer:
+                    if token:
+                        streamed = True
+                        yield sse_event({"token": token})
+            prompt, response = future.result()
+            if not streamed:
+                # Relay a cached, coalesced or map-reduced result in one chunk
+                completion = response[len(prompt):] if response.startswith(prompt) else response
+                yield sse_event({"token": completion})
+            if source == "cache":
+                logger.info("Job extraction served from cache")
+            else:
+                logger.info("Job extraction completed successfully")
+            
+            yield sse_event({
+                "success": True,
+                "prompt": prompt,
+                "response": response,
+                "job_title": job_title,
+                "company": company
+            }, event="done")
+            
+        except Exception as e:
+            logger.error(f"Error during streamed extraction: {str(e)}")
+            yield sse_event({
+                "error": f"An error occurred during extraction: {str(e)}"
+            }, event="error")
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Submit an extraction job; returns its id immediately (202) or 429 when the queue is full"""
+    if generator is None or job_store is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    job_title, company, job_description = read_job_params()
+    adapter = read_adapter()
+    
+    if not job_description.strip():
+        return jsonify({
+            "error": "job_description parameter is required"
+        }), 400
+    if not adapter_registry.has(adapter):
+        return unknown_adapter_response(adapter)
+    
+    try:
+        job_id = job_store.submit(job_title, company, job_description, adapter)
+    except queue.Full:
+        logger.info("Job queue full, rejecting submission")
+        return jsonify({
+            "error": "Too many pending jobs. Please retry later."
+        }), 429, {"Retry-After": str(JOB_RETRY_AFTER)}
+    
+    logger.info(f"Queued extraction job {job_id}")
+    
+    status_url = f"/jobs/{job_id}"
+    return jsonify({
+        "id": job_id,
+        "status": "queued",
+        "status_url": status_url
+    }), 202, {"Location": status_url}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the status of an extraction job, including its result once completed"""
+    if job_store is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    description = job_store.status(job_id)
+    if description is None:
+        return jsonify({
+            "error": f"Unknown or expired job id: {job_id}"
+        }), 404
+    return jsonify(description)
+
+def admin_rejection():
+    """Error response for an admin call that is not allowed, or None.
+
+    Admin calls load weights from any path or hub id, so without a configured
+    token the endpoints are disabled rather than open.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled; set EXTRACT_ADMIN_TOKEN to enable them"}), 404
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "Admin token missing or invalid"}), 403
+    return None
+
+@app.route('/admin/adapters', methods=['GET'])
+def list_adapters():
+    """List the resident LoRA adapters and their memory use"""
+    rejection = admin_rejection()
+    if rejection is not None:
+        return rejection
+    if adapter_registry is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    return jsonify({
+        "multi_adapter": adapter_registry.multi,
+        "memory_budget_mb": ADAPTER_MEMORY_BUDGET_MB,
+        "adapters": adapter_registry.describe()
+    })
+
+@app.route('/admin/adapters', methods=['POST'])
+def load_adapter():
+    """Load a LoRA adapter by name: {"name": ..., "path": ...}"""
+    rejection = admin_rejection()
+    if rejection is not None:
+        return rejection
+    if adapter_registry is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    body = request.get_json(silent=True) or {}
+    name = str(body.get('name', '') or '').strip()
+    path = str(body.get('path', '') or '').strip()
+    if not name or not path:
+        return jsonify({
+            "error": "name and path are required"
+        }), 400
+    
+    try:
+        adapter_registry.load(name, path)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error loading adapter {name}: {str(e)}")
+        return jsonify({
+            "error": f"An error occurred while loading the adapter: {str(e)}"
+        }), 500
+    
+    return jsonify({
+        "success": True,
+        "adapters": adapter_registry.describe()
+    }), 201
+
+@app.route('/admin/adapters/<name>', methods=['DELETE'])
+def unload_adapter(name):
+    """Unload a LoRA adapter; requests queued for it will fail"""
+    rejection = admin_rejection()
+    if rejection is not None:
+        return rejection
+    if adapter_registry is None:
+        return jsonify({
+            "error": "Model not loaded. Please wait for the server to initialize."
+        }), 503
+    
+    try:
+        adapter_registry.unload(name)
+    except KeyError:
+        return unknown_adapter_response(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    
+    return jsonify({
+        "success": True,
+        "adapters": adapter_registry.describe()
+    })
 
 
 @app.route('/', methods=['GET'])
@@ -129,7 +2101,151 @@ def home():
         "message": "Job Information Extractor API"
     })
 
+
+def read_records(path):
+    """Lazily yield posting dicts from a JSONL or CSV file"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Yielded as-is so extract_window reports it as a failed record
+                yield line.strip()
+
+def read_progress(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_progress(path, progress):
+    """Replace the progress file atomically so a kill never leaves it half written"""
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(path + ".tmp", path)
+
+def extract_window(window):
+    """Extract one window of (index, record) pairs, queued shortest first so batches pad little"""
+    pending = {}
+    window = [(index, record if isinstance(record, dict) else None) for index, record in window]
+    for index, record in sorted(window, key=lambda item: len(str((item[1] or {}).get('job_description') or ''))):
+        if record is None:
+            pending[index] = (record, None, "record is not a JSON object")
+            continue
+        job_title = str(record.get('job_title') or '')
+        company = str(record.get('company') or '')
+        job_description = str(record.get('job_description') or '')
+        if not job_description.strip():
+            pending[index] = (record, None, "job_description is required")
+        else:
+            pending[index] = (record, submit_extraction(job_title, company, job_description)[0], None)
+    
+    results = []
+    for index, record in window:
+        _, submitted, error = pending[index]
+        record = record or {}
+        result = {"index": index, "job_title": str(record.get('job_title') or ''), "company": str(record.get('company') or '')}
+        if 'id' in record:
+            result["id"] = record['id']
+        if submitted is not None:
+            try:
+                prompt, response = submitted.result()
+                result.update({"success": True, "response": response, "extraction": parse_extraction(prompt, response)})
+                results.append(result)
+                continue
+            except Exception as e:
+                logger.error(f"Error during offline extraction of record {index}: {str(e)}")
+                error = f"An error occurred during extraction: {str(e)}"
+        result.update({"success": False, "error": error})
+        results.append(result)
+    return results
+
+def run_offline_extraction(input_path, output_path):
+    """Extract every posting in a JSONL/CSV file to a JSONL file without starting the HTTP server.
+
+    Progress is checkpointed after every window to ``<output>.progress``; rerunning
+    the same command resumes after the last completed window.
+    """
+    progress_path = output_path + ".progress"
+    progress = read_progress(progress_path)
+    if progress is None:
+        if os.path.exists(output_path) and os.path.getsize(output_path):
+            raise ValueError(f"{output_path} already exists without a progress file; choose another --output")
+        progress = {"input": os.path.abspath(input_path), "records": 0, "output_bytes": 0}
+    if progress["input"] != os.path.abspath(input_path):
+        raise ValueError(f"{progress_path} belongs to {progress['input']}; remove it to start over")
+    if progress["records"]:
+        logger.info(f"Resuming after {progress['records']} records")
+    
+    load_model()
+    if generator is None:
+        raise RuntimeError("Model failed to load")
+    
+    start = time.perf_counter()
+    done = 0
+    with open(output_path, 'a+', encoding='utf-8') as out:
+        # Drop results written after the last checkpoint by a run that was killed mid-window
+        out.truncate(progress["output_bytes"])
+        out.seek(0, os.SEEK_END)
+        
+        window = []
+        records = enumerate(read_records(input_path))
+        for index, record in records:
+            if index < progress["records"]:
+                continue
+            window.append((index, record))
+            if len(window) < OFFLINE_WINDOW:
+                continue
+            done += write_window(out, window, progress, progress_path)
+            logger.info(f"{progress['records']} records done ({done / (time.perf_counter() - start):.2f} records/sec)")
+            window = []
+        if window:
+            done += write_window(out, window, progress, progress_path)
+    
+    elapsed = time.perf_counter() - start
+    logger.info(f"Extracted {done} records in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.2f} records/sec); "
+                f"{progress['records']} total in {output_path}")
+
+def write_window(out, window, progress, progress_path):
+    for result in extract_window(window):
+        out.write(json.dumps(result) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+    progress["records"] = window[-1][0] + 1
+    progress["output_bytes"] = out.tell()
+    write_progress(progress_path, progress)
+    return len(window)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Job Information Extractor server")
+    parser.add_argument("--export", metavar="DIR",
+                        help="Merge the LoRA adapter into the quantized base model, save it to DIR and exit")
+    parser.add_argument("--benchmark", metavar="RUNS", type=int,
+                        help="Load the model, time RUNS extractions of a sample posting, report tokens/sec and exit")
+    parser.add_argument("--extract-file", metavar="INPUT",
+                        help="Extract every posting in a JSONL or CSV file without starting the server, then exit")
+    parser.add_argument("--output", metavar="OUTPUT",
+                        help="JSONL file receiving --extract-file results (default: INPUT with a .extracted.jsonl suffix)")
+    args = parser.parse_args()
+    
+    if args.export:
+        export_merged_model(args.export)
+        raise SystemExit(0)
+    
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+        raise SystemExit(0)
+    
+    if args.extract_file:
+        run_offline_extraction(args.extract_file, args.output or os.path.splitext(args.extract_file)[0] + ".extracted.jsonl")
+        raise SystemExit(0)
+    
     logger.info("Starting Job Extractor Server...")
     
     try:
@@ -138,4 +2254,4 @@ if __name__ == '__main__':
         logger.error("Failed to load model. Server will start but /extract endpoint will not work.")
     
     logger.info("Starting Flask server on localhost:5000...")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
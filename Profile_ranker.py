@@ -0,0 +1,352 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+# Entries forwarded per profile section: what the Gemini prompt asks it to pick, plus some slack
+SECTION_TOP_K = {
+    'experience': 3,
+    'projects': 4,
+    'por': 4,
+    'achievements': 3,
+}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Query weight of each field of the extraction
+QUERY_FIELDS = {
+    "Required Skills": 2.0,
+    "Core Responsibilities": 1.0,
+}
+
+# Score added per extracted required skill that appears in an entry's skill set
+SKILL_MATCH_BONUS = 1.0
+
+# Profiles whose index is kept in memory
+INDEX_CACHE_SIZE = 8
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or our that the their this to was were will with
+we you your us i my me n/a na
+""".split())
+
+
+def tokenize(text):
+    """Lowercase terms, keeping tokens such as c++, c# and node.js intact"""
+    return [token for token in TOKEN_PATTERN.findall(str(text or "").lower()) if token not in STOPWORDS]
+
+
+def entry_text(section, entry):
+    """The searchable text of one profile entry"""
+    if isinstance(entry, dict):
+        return " ".join(str(value) for key, value in entry.items() if key not in ('duration', 'year', 'cgpa'))
+    return str(entry)
+
+
+def profile_entries(profile):
+    """(section, index, text) for every rankable entry of a profile"""
+    entries = []
+    for section in SECTION_TOP_K:
+        for index, entry in enumerate(profile.get(section) or []):
+            entries.append((section, index, entry_text(section, entry)))
+    return entries
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count (about four characters per token) for reporting without a network call"""
+    return math.ceil(len(text) / 4)
+
+
+def profile_stat(profile_path):
+    """Size and modification time of the profile file, to tell cheaply whether it changed"""
+    try:
+        stat = os.stat(profile_path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def entry_hash(section, text):
+    return hashlib.sha256(f"{section}\0{text}".encode('utf-8')).hexdigest()
+
+
+def index_paths(profile_path):
+    """Metadata and term-matrix files stored next to a profile file"""
+    base = os.path.splitext(profile_path)[0]
+    return base + ".index.json", base + ".index.npy"
+
+
+class ProfileIndex:
+    """Per-entry tokens, skill sets and term vectors of a profile, for BM25 scoring.
+
+    ``tf`` is a (vocabulary x entries) term-count matrix, so scoring only reads
+    the rows of the query's terms: the cost grows with the job description,
+    not with the profile. Document frequencies and entry lengths are stored
+    alongside, so nothing is recomputed over the whole profile at query time.
+    """
+
+    def __init__(self, vocabulary, df, entries, tf, skills):
+        self.vocabulary = vocabulary
+        self.skills = skills
+        self.df = df
+        self.entries = entries
+        self.tf = tf
+        self.lengths = np.array([entry['length'] for entry in entries], dtype=np.float32)
+        self.average_length = max(float(self.lengths.mean()), 1.0) if entries else 1.0
+
+    @classmethod
+    def build(cls, profile, previous=None):
+        """Index a profile, re-tokenizing only entries whose content hash changed since ``previous``"""
+        known = {}
+        if previous is not None:
+            for entry in previous.entries:
+                known[entry['hash']] = entry['tokens']
+        skills = {skill.lower(): tokenize(skill) for skill in profile.get('skills') or []}
+
+        vocabulary = {}
+        entries = []
+        retokenized = 0
+        for section, position, text in profile_entries(profile):
+            digest = entry_hash(section, text)
+            tokens = known.get(digest)
+            if tokens is None:
+                tokens = tokenize(text)
+                retokenized += 1
+            token_set = set(tokens)
+            entries.append({
+                'section': section,
+                'position': position,
+                'hash': digest,
+                'tokens': tokens,
+                'skills': sorted(skill for skill, terms in skills.items() if terms and token_set.issuperset(terms)),
+                'length': len(tokens),
+            })
+            for token in tokens:
+                vocabulary.setdefault(token, len(vocabulary))
+
+        tf = np.zeros((len(vocabulary), len(entries)), dtype=np.float32)
+        for column, entry in enumerate(entries):
+            for term, count in Counter(entry['tokens']).items():
+                tf[vocabulary[term], column] = count
+        df = (tf > 0).sum(axis=1).astype(np.float32)
+        index = cls(vocabulary, df, entries, tf, sorted(skills))
+        index.retokenized = retokenized
+        return index
+
+    def save(self, profile_path):
+        """Write the index next to the profile, replacing each file atomically"""
+        meta_path, matrix_path = index_paths(profile_path)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'profile_stat': profile_stat(profile_path),
+                'vocabulary': terms,
+                'df': self.df.tolist(),
+                'skills': self.skills,
+                'entries': self.entries,
+            }, f)
+        with open(matrix_path + ".tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.tf))
+        os.replace(matrix_path + ".tmp", matrix_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.profile_stat = profile_stat(profile_path)
+
+    @classmethod
+    def load(cls, profile_path):
+        """Load a saved index with the term matrix memory-mapped, or None if there is no usable one"""
+        meta_path, matrix_path = index_paths(profile_path)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            tf = np.load(matrix_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != INDEX_VERSION or tf.shape != (len(meta['vocabulary']), len(meta['entries'])):
+            return None
+        vocabulary = {term: row for row, term in enumerate(meta['vocabulary'])}
+        index = cls(vocabulary, np.array(meta['df'], dtype=np.float32), meta['entries'], tf, meta.get('skills', []))
+        index.profile_stat = meta.get('profile_stat')
+        return index
+
+    def matches(self, profile):
+        """True when the index was built from exactly this profile's entries and skills"""
+        entries = profile_entries(profile)
+        if len(entries) != len(self.entries):
+            return False
+        skills = sorted({skill.lower() for skill in profile.get('skills') or []})
+        return self.skills == skills and all(
+            entry['hash'] == entry_hash(section, text) for entry, (section, _, text) in zip(self.entries, entries)
+        )
+
+    def scores(self, weighted_terms, required_skills=()):
+        """BM25 score of every entry, plus a bonus per required skill in the entry's skill set"""
+        if not self.entries:
+            return np.zeros(0, dtype=np.float32)
+        rows = []
+        weights = []
+        for term, weight in weighted_terms.items():
+            row = self.vocabulary.get(term)
+            if row is not None:
+                rows.append(row)
+                weights.append(weight)
+        scores = np.zeros(len(self.entries), dtype=np.float32)
+        if rows:
+            tf = np.asarray(self.tf[rows], dtype=np.float32)
+            df = self.df[rows]
+            idf = np.log1p((len(self.entries) - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / self.average_length)
+            scores += (np.array(weights, dtype=np.float32) * idf) @ (tf * (BM25_K1 + 1) / (tf + norm))
+        if required_skills:
+            for column, entry in enumerate(self.entries):
+                scores[column] += SKILL_MATCH_BONUS * len(required_skills.intersection(entry['skills']))
+        return scores
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_profile_index(profile, profile_path=None):
+    """Index for a profile: the saved one next to profile_path when it is current, else a rebuilt one.
+
+    profile must be the contents of profile_path. A stale saved index is
+    updated incrementally and saved back; without a profile_path, indexes are
+    only cached in memory.
+    """
+    if profile_path is not None:
+        meta_path, _ = index_paths(profile_path)
+        key = (meta_path, tuple(profile_stat(meta_path) or ()))
+        with _index_cache_lock:
+            index = _index_cache.get(key)
+        if index is None:
+            index = ProfileIndex.load(profile_path)
+        # An index saved right after the profile file was written is trusted without rehashing entries
+        if index is not None and (index.profile_stat == profile_stat(profile_path) or index.matches(profile)):
+            with _index_cache_lock:
+                _index_cache[key] = index
+                while len(_index_cache) > INDEX_CACHE_SIZE:
+                    _index_cache.popitem(last=False)
+            return index
+        return update_profile_index(profile_path, profile, index)
+
+    entries = profile_entries(profile)
+    key = hashlib.sha256(json.dumps([entries, profile.get('skills') or []]).encode('utf-8')).hexdigest()
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = ProfileIndex.build(profile)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def update_profile_index(profile_path, profile, previous=None):
+    """Bring the index next to profile_path up to date with profile, re-tokenizing only changed entries"""
+    if previous is None:
+        previous = ProfileIndex.load(profile_path)
+    index = ProfileIndex.build(profile, previous)
+    index.save(profile_path)
+    print(f"Profile index updated: {index.retokenized}/{len(index.entries)} entries re-tokenized")
+    return index
+
+
+def parse_extraction(response):
+    """The extraction object inside the extractor's response text, or {} if none parses"""
+    decoder = json.JSONDecoder()
+    position = response.find('{')
+    while position >= 0:
+        try:
+            parsed, _ = decoder.raw_decode(response, position)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict) and any(field in parsed for field in QUERY_FIELDS):
+            return parsed
+        position = response.find('{', position + 1)
+    return {}
+
+
+def query_terms(extraction):
+    """Weighted query terms from the extracted skills and responsibilities"""
+    terms = Counter()
+    for field, weight in QUERY_FIELDS.items():
+        value = extraction.get(field)
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, list):
+            value = " ".join(str(item) for item in value)
+        for term in tokenize(value):
+            terms[term] += weight
+    return terms
+
+
+def required_skill_set(extraction):
+    value = extraction.get("Required Skills")
+    if isinstance(value, str):
+        value = re.split(r"[,;\n]", value)
+    if not isinstance(value, list):
+        return set()
+    return {str(skill).strip().lower() for skill in value if str(skill).strip()}
+
+
+def rank_profile(profile, required_skills, top_k=None, profile_path=None):
+    """Keep only the top-k entries per section most relevant to the extracted requirements.
+
+    Returns ``(ranked_profile, report)``; kept entries stay in their original
+    order and sections within their limit are forwarded untouched. With a
+    profile_path the persisted index next to that file is used (and updated).
+    When the extraction holds no parseable JSON (e.g. "Skills extraction
+    failed") there is nothing to rank against and the whole profile is kept.
+    """
+    extraction = parse_extraction(required_skills)
+    if not extraction:
+        tokens = estimate_tokens(json.dumps(profile, indent=2))
+        entries = len(profile_entries(profile))
+        return dict(profile), {
+            "ranked": False,
+            "profile_tokens_before": tokens,
+            "profile_tokens_after": tokens,
+            "entries_before": entries,
+            "entries_after": entries,
+        }
+
+    top_k = SECTION_TOP_K if top_k is None else top_k
+    index = get_profile_index(profile, profile_path)
+    scores = index.scores(query_terms(extraction), required_skill_set(extraction))
+
+    by_section = {}
+    for entry, score in zip(index.entries, scores):
+        by_section.setdefault(entry['section'], []).append((float(score), entry['position']))
+
+    ranked = dict(profile)
+    for section, scored in by_section.items():
+        limit = top_k.get(section)
+        if limit is None or len(scored) <= limit:
+            continue
+        # Ties keep the earlier entry
+        keep = sorted(position for _, position in sorted(scored, key=lambda item: (-item[0], item[1]))[:limit])
+        ranked[section] = [profile[section][position] for position in keep]
+
+    before = estimate_tokens(json.dumps(profile, indent=2))
+    after = estimate_tokens(json.dumps(ranked, indent=2))
+    report = {
+        "ranked": True,
+        "profile_tokens_before": before,
+        "profile_tokens_after": after,
+        "entries_before": len(index.entries),
+        "entries_after": sum(len(ranked.get(section) or []) for section in SECTION_TOP_K),
+    }
+    return ranked, report
@@ -6,12 +6,22 @@ from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
+    Trainer,
+    TrainerCallback,
     TrainingArguments,
 )
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
-from trl import SFTTrainer
-from datasets import Dataset
+from datasets import Dataset, load_from_disk
+import csv
+import glob
+import gzip
+import hashlib
+import json
 import os
+import re
+import shutil
+import signal
+import time
 
 # Check GPU availability
 print(f"GPU available: {torch.cuda.is_available()}")
@@ -19,30 +29,344 @@ print(f"GPU name: {torch.cuda.get_device_name(0) if torch.cuda.is_available() el
 print(f"GPU memory: {torch.cuda.get_device_properties(0).total_memory / 1e9 if torch.cuda.is_available() else 0} GB")
 
 
-# Load your training data
-def load_training_data(file_path):
-    """Load the training data from text file"""
-    examples = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    raw_examples = content.split('\n\n')
+# Training data: comma-separated files or globs of blank-line separated text or JSONL
+# records with a "text" field, optionally gzip-compressed (.gz)
+TRAIN_DATA_FILES = os.getenv("TRAIN_DATA_FILES", "./mistral_training_data.txt")
+# Processes used to read and tokenize the corpus
+TRAIN_DATA_WORKERS = int(os.getenv("TRAIN_DATA_WORKERS", "1"))
+
+# Every training example must end with an extraction object containing these keys
+EXPECTED_ANSWER_KEYS = [
+    "Core Responsibilities",
+    "Required Skills",
+    "Educational Requirements",
+    "Experience Level",
+    "Preferred Qualifications",
+    "Compensation and Benefits",
+]
+
+
+def resolve_data_files(spec):
+    paths = []
+    for pattern in spec.split(','):
+        matches = sorted(glob.glob(pattern.strip()))
+        if not matches:
+            raise FileNotFoundError(f"No training data matches {pattern.strip()}")
+        paths.extend(matches)
+    return paths
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def read_examples(path):
+    """Yield raw example texts from one file, one at a time"""
+    with open_text(path) as f:
+        if path.endswith(('.jsonl', '.jsonl.gz')):
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Yielded as-is so it is counted as invalid
+                    yield line
+                    continue
+                yield record.get('text', '') if isinstance(record, dict) else line
+            return
+        
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            elif lines:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+
+def find_answer(text):
+    """Return the extraction object in a training example, or None if it is missing or malformed"""
+    decoder = json.JSONDecoder()
+    response = text.find('### Response:')
+    position = text.find('{', max(response, 0))
+    while position >= 0:
+        try:
+            answer, _ = decoder.raw_decode(text, position)
+        except ValueError:
+            answer = None
+        if isinstance(answer, dict) and all(key in answer for key in EXPECTED_ANSWER_KEYS):
+            return answer
+        position = text.find('{', position + 1)
+    return None
+
+
+def iter_training_examples(paths, shard_index=0, num_shards=1):
+    """Lazily yield valid, de-duplicated example texts belonging to one shard.
+
+    Examples are assigned to shards by content hash, so every copy of a duplicate
+    lands in the same shard and each shard only remembers its own hashes.
+    """
+    seen = set()
+    kept = duplicates = invalid = 0
+    for path in paths:
+        for text in read_examples(path):
+            text = text.strip()
+            if not text:
+                continue
+            digest = hashlib.sha256(' '.join(text.split()).encode('utf-8')).digest()[:16]
+            if int.from_bytes(digest[:4], 'big') % num_shards != shard_index:
+                continue
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            if find_answer(text) is None:
+                invalid += 1
+                continue
+            kept += 1
+            yield text
+    print(f"Data shard {shard_index + 1}/{num_shards}: kept {kept} examples, "
+          f"skipped {duplicates} duplicates and {invalid} without a valid JSON answer")
+
+
+train_data_paths = resolve_data_files(TRAIN_DATA_FILES)
+print(f"Training data files: {train_data_paths}")
+
+model_name = "mistralai/Mistral-7B-Instruct-v0.2"
+
+MAX_SEQ_LENGTH = 1024
+# Pack several examples into each MAX_SEQ_LENGTH row instead of padding one example per row
+PACK_SEQUENCES = os.getenv("TRAIN_PACK_SEQUENCES", "1") == "1"
+TOKENIZED_CACHE_DIR = "./tokenized-cache"
+# Partly filled rows held open while packing; beyond this the fullest one is written out
+PACK_OPEN_ROWS = 256
+
+tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+tokenizer.pad_token = tokenizer.eos_token
+tokenizer.padding_side = "right"
+tokenizer.model_max_length = MAX_SEQ_LENGTH
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Identify the tokenizer by its vocabulary and special tokens"""
+    payload = json.dumps([
+        tokenizer.name_or_path,
+        sorted(tokenizer.get_vocab().items()),
+        tokenizer.bos_token,
+        tokenizer.eos_token,
+        tokenizer.model_max_length,
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def data_fingerprint(paths):
+    """Hash the contents of every data file plus the settings that decide which examples are kept"""
+    digest = hashlib.sha256(json.dumps(EXPECTED_ANSWER_KEYS).encode('utf-8'))
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenize_shard(shard_indices, paths, num_shards, tokenizer):
+    """Tokenize the examples of the given shards, ending each with EOS and truncating to the model length.
+
+    from_generator hands every worker its slice of the shard_indices list, so
+    this always receives a list, even with a single worker.
+    """
+    for shard_index in shard_indices:
+        for text in iter_training_examples(paths, shard_index, num_shards):
+            input_ids = tokenizer(text, add_special_tokens=True).input_ids
+            input_ids = (input_ids + [tokenizer.eos_token_id])[:tokenizer.model_max_length]
+            yield {'input_ids': input_ids, 'length': len(input_ids)}
+
+
+def load_tokenized_dataset(paths, tokenizer, cache_dir=TOKENIZED_CACHE_DIR, num_workers=TRAIN_DATA_WORKERS, data_key=None):
+    """Tokenize the training data, reusing the Arrow copy cached for this tokenizer and data.
+
+    Examples stream straight from the files into Arrow, so memory use does not
+    grow with the size of the corpus.
+    """
+    data_key = data_key or data_fingerprint(paths)
+    key = hashlib.sha256(f"{tokenizer_fingerprint(tokenizer)}|{data_key}".encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        print(f"Loading tokenized dataset from {path}")
+        return require_examples(load_from_disk(path), paths)
     
-    for example in raw_examples:
-        if example.strip():  
-            examples.append({'text': example.strip()})
+    print(f"Tokenizing training data with {num_workers} worker(s)...")
+    build_dir = path + "-build"
+    tokenized = Dataset.from_generator(
+        tokenize_shard,
+        # Only list arguments are split across workers; paths is a tuple so every worker reads all files
+        gen_kwargs={'shard_indices': list(range(num_workers)), 'paths': tuple(paths), 'num_shards': num_workers, 'tokenizer': tokenizer},
+        num_proc=num_workers if num_workers > 1 else None,
+        cache_dir=build_dir,
+    )
+    # Renamed into place once complete, so an interrupted save is never loaded as the cache
+    temporary_path = path + "-tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    tokenized.save_to_disk(temporary_path)
+    os.replace(temporary_path, path)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    print(f"Cached tokenized dataset at {path}")
+    return require_examples(load_from_disk(path), paths)
+
+
+def require_examples(tokenized, paths):
+    if len(tokenized) == 0:
+        raise ValueError(f"No valid training examples in {paths}; each needs a JSON answer with the keys {EXPECTED_ANSWER_KEYS}")
+    return tokenized
+
+
+def pack_sequences(tokenized, max_length=MAX_SEQ_LENGTH, max_open_rows=PACK_OPEN_ROWS):
+    """Pack examples into rows of at most max_length tokens in one streaming pass (best fit).
+
+    Open rows are bucketed by remaining capacity, so placing an example scans
+    at most max_length buckets and packing is O(examples x max_length). At most
+    max_open_rows rows are held in memory; the rest are written out as they
+    fill, so memory use does not grow with the corpus. Examples are never
+    split. position_ids restart at 0 for every example, which the collator
+    uses to keep attention and the loss inside example boundaries.
+    """
+    def packed_rows():
+        # buckets[r] holds the open rows with exactly r tokens of room left
+        buckets = [[] for _ in range(max_length + 1)]
+        open_rows = 0
+        for example in tokenized:
+            input_ids = example['input_ids']
+            length = len(input_ids)
+            # The open row with the least room that still fits this example
+            row = None
+            for remaining in range(length, max_length + 1):
+                if buckets[remaining]:
+                    row = buckets[remaining].pop()
+                    break
+            if row is None:
+                row = {'input_ids': [], 'position_ids': []}
+                open_rows += 1
+            row['input_ids'].extend(input_ids)
+            row['position_ids'].extend(range(length))
+            
+            remaining = max_length - len(row['input_ids'])
+            if remaining == 0:
+                open_rows -= 1
+                yield finished_row(row)
+            else:
+                buckets[remaining].append(row)
+            
+            if open_rows > max_open_rows:
+                fullest = next(bucket for bucket in buckets if bucket)
+                open_rows -= 1
+                yield finished_row(fullest.pop())
+        
+        for bucket in buckets:
+            for row in bucket:
+                yield finished_row(row)
     
-    return examples
+    return Dataset.from_generator(packed_rows)
 
-train_data_path = "./mistral_training_data.txt" 
 
-training_examples = load_training_data(train_data_path)
-print(f"Loaded {len(training_examples)} training examples")
+def finished_row(row):
+    return {'input_ids': row['input_ids'], 'position_ids': row['position_ids'], 'length': len(row['input_ids'])}
 
-dataset = Dataset.from_list(training_examples)
-print(f"Dataset structure: {dataset}")
 
-model_name = "mistralai/Mistral-7B-Instruct-v0.2"
+def unpacked_sequences(tokenized):
+    return tokenized.map(lambda row: {'position_ids': list(range(row['length']))})
+
+
+class PackedCollator:
+    """Pad a batch of (possibly packed) rows and build block-diagonal causal attention.
+
+    Each row's examples are found from where its position_ids restart at 0. The
+    4D additive mask lets a token attend only to earlier tokens of its own example,
+    and the first token of every example is excluded from the loss so no example
+    is trained to predict the start of the next one.
+    """
+
+    def __init__(self, pad_token_id, mask_dtype):
+        self.pad_token_id = pad_token_id
+        self.mask_dtype = mask_dtype
+        # Read by ThroughputCallback; only accurate while batches are collated in the main process
+        self.tokens_seen = 0
+        self.samples_seen = 0
+
+    def __call__(self, rows):
+        width = max(len(row['input_ids']) for row in rows)
+        input_ids = torch.full((len(rows), width), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((len(rows), width), dtype=torch.long)
+        labels = torch.full((len(rows), width), -100, dtype=torch.long)
+        segments = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, row in enumerate(rows):
+            length = len(row['input_ids'])
+            ids = torch.tensor(row['input_ids'], dtype=torch.long)
+            positions = torch.tensor(row['position_ids'], dtype=torch.long)
+            input_ids[i, :length] = ids
+            position_ids[i, :length] = positions
+            labels[i, :length] = torch.where(positions == 0, -100, ids)
+            # Segment 0 is padding; examples are numbered from 1
+            segments[i, :length] = torch.cumsum(positions == 0, dim=0)
+            self.tokens_seen += length
+            self.samples_seen += int((positions == 0).sum())
+        
+        causal = torch.tril(torch.ones((width, width), dtype=torch.bool))
+        same_example = (segments[:, :, None] == segments[:, None, :]) & (segments[:, None, :] > 0)
+        # Padding queries attend to themselves so no row of the mask is fully blocked
+        allowed = (same_example & causal) | torch.eye(width, dtype=torch.bool)
+        attention_mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        attention_mask.masked_fill_(~allowed, torch.finfo(self.mask_dtype).min)
+        return {
+            'input_ids': input_ids,
+            'position_ids': position_ids,
+            'attention_mask': attention_mask[:, None, :, :],
+            'labels': labels,
+        }
+
+
+def length_histogram(dataset, max_length=MAX_SEQ_LENGTH):
+    """Count rows per length, reading the length column in batches rather than as one list"""
+    counts = [0] * (max_length + 1)
+    for batch in dataset.select_columns(['length']).iter(batch_size=10000):
+        for length in batch['length']:
+            counts[length] += 1
+    return counts
+
+
+def padding_efficiency(counts, batch_size):
+    """Fraction of token slots that hold real tokens when rows are batched by length.
+
+    Works from a length histogram: in length order, a batch is padded to the
+    length of its last row, so each length pays for the batches that end on it.
+    """
+    tokens = slots = rows = 0
+    last_length = 0
+    for length, count in enumerate(counts):
+        if not count:
+            continue
+        tokens += length * count
+        slots += length * batch_size * ((rows + count) // batch_size - rows // batch_size)
+        rows += count
+        last_length = length
+    slots += last_length * (rows % batch_size)
+    return tokens / slots if slots else 1.0
+
+
+train_data_key = data_fingerprint(train_data_paths)
+tokenized = load_tokenized_dataset(train_data_paths, tokenizer, data_key=train_data_key)
+dataset = pack_sequences(tokenized) if PACK_SEQUENCES else unpacked_sequences(tokenized)
+tokenized_lengths = length_histogram(tokenized)
+real_tokens = sum(length * count for length, count in enumerate(tokenized_lengths))
+print(f"Dataset structure: {dataset}")
+print(f"{real_tokens} training tokens: {len(tokenized)} unpadded rows at {padding_efficiency(tokenized_lengths, 2):.1%} padding efficiency")
+if PACK_SEQUENCES:
+    print(f"Packed into {len(dataset)} rows of up to {MAX_SEQ_LENGTH} tokens at {padding_efficiency(length_histogram(dataset), 2):.1%} padding efficiency")
 
 bnb_config = BitsAndBytesConfig(
     load_in_4bit=True,
@@ -60,29 +384,28 @@ model = AutoModelForCausalLM.from_pretrained(
     low_cpu_mem_usage=True,
 )
 
-tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-tokenizer.pad_token = tokenizer.eos_token
-tokenizer.padding_side = "right"
-
 model = prepare_model_for_kbit_training(model)
 
+# LoRA rank and target modules can be overridden to compare configurations on cost as well as loss
+LORA_R = int(os.getenv("TRAIN_LORA_R", "16"))
+LORA_TARGET_MODULES = os.getenv(
+    "TRAIN_LORA_TARGET_MODULES", "q_proj,k_proj,v_proj,o_proj,gate_proj,up_proj,down_proj"
+).split(",")
+
 peft_config = LoraConfig(
     lora_alpha=32,          
     lora_dropout=0.05,      
-    r=16,                   
+    r=LORA_R,                   
     bias="none",
     task_type="CAUSAL_LM",
-    target_modules=[
-        "q_proj", "k_proj", "v_proj", "o_proj",
-        "gate_proj", "up_proj", "down_proj"
-    ]
+    target_modules=LORA_TARGET_MODULES,
 )
 
 model = get_peft_model(model, peft_config)
 
 model.print_trainable_parameters()
 training_arguments = TrainingArguments(
-    output_dir="./mistral-job-extractor",
+    output_dir=os.getenv("TRAIN_OUTPUT_DIR", "./mistral-job-extractor"),
     num_train_epochs=3,
     per_device_train_batch_size=2,          
     gradient_accumulation_steps=4,          
@@ -95,7 +418,8 @@ training_arguments = TrainingArguments(
     bf16=False,
     max_grad_norm=0.3,
     warmup_ratio=0.05,
-    group_by_length=True,
+    # Packed rows are all close to MAX_SEQ_LENGTH, so grouping only helps unpacked data
+    group_by_length=not PACK_SEQUENCES,
     lr_scheduler_type="cosine",
     report_to="none",
     eval_strategy="no",                     
@@ -103,21 +427,223 @@ training_arguments = TrainingArguments(
     dataloader_pin_memory=False,            
     remove_unused_columns=False,           
 )
-def formatting_func(example):
-    return example["text"]
 
-tokenizer.model_max_length = 1024
 
-trainer = SFTTrainer(
+
+class ThroughputCallback(TrainerCallback):
+    """Record samples/sec, tokens/sec, step time breakdown and peak GPU memory every logging step.
+
+    Rows are appended to throughput.csv in the output directory, so a resumed
+    run continues the same log; throughput.json summarizes the run and its LoRA
+    configuration when training ends.
+    """
+
+    FIELDS = [
+        "step", "epoch", "loss", "samples_per_sec", "tokens_per_sec",
+        "data_seconds", "forward_backward_seconds", "optimizer_seconds", "peak_memory_gb",
+    ]
+
+    def __init__(self, collator, output_dir):
+        self.collator = collator
+        self.csv_path = os.path.join(output_dir, "throughput.csv")
+        self.json_path = os.path.join(output_dir, "throughput.json")
+        self.run_start = None
+        self.run_tokens = 0
+        self.run_samples = 0
+        self._reset_window()
+        self.step_end = None
+        self.step_begin = None
+        self.pre_optimizer = None
+
+    def _reset_window(self):
+        self.window_start = time.perf_counter()
+        self.window_tokens = self.collator.tokens_seen
+        self.window_samples = self.collator.samples_seen
+        self.timings = {"data_seconds": 0.0, "forward_backward_seconds": 0.0, "optimizer_seconds": 0.0}
+        self.window_steps = 0
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.run_start = time.perf_counter()
+        self.run_tokens = self.collator.tokens_seen
+        self.run_samples = self.collator.samples_seen
+        self._reset_window()
+        self.step_end = time.perf_counter()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.step_begin = time.perf_counter()
+        self.pre_optimizer = None
+        if self.step_end is not None:
+            self.timings["data_seconds"] += self.step_begin - self.step_end
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self.pre_optimizer = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.step_end = time.perf_counter()
+        # Older transformers releases have no pre-optimizer hook; the whole step then counts as forward/backward
+        split = self.pre_optimizer or self.step_end
+        self.timings["forward_backward_seconds"] += split - self.step_begin
+        self.timings["optimizer_seconds"] += self.step_end - split
+        self.window_steps += 1
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if not state.is_world_process_zero or "loss" not in (logs or {}) or not self.window_steps:
+            return
+        elapsed = time.perf_counter() - self.window_start
+        row = {
+            "step": state.global_step,
+            "epoch": round(state.epoch or 0, 4),
+            "loss": logs["loss"],
+            "samples_per_sec": round((self.collator.samples_seen - self.window_samples) / elapsed, 3),
+            "tokens_per_sec": round((self.collator.tokens_seen - self.window_tokens) / elapsed, 1),
+            "peak_memory_gb": round(torch.cuda.max_memory_allocated() / 1e9, 3) if torch.cuda.is_available() else 0,
+        }
+        for name, seconds in self.timings.items():
+            row[name] = round(seconds / self.window_steps, 4)
+        
+        new_file = not os.path.exists(self.csv_path)
+        with open(self.csv_path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+        self._reset_window()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        elapsed = time.perf_counter() - self.run_start
+        summary = {
+            "lora_r": LORA_R,
+            "lora_target_modules": LORA_TARGET_MODULES,
+            "packed": PACK_SEQUENCES,
+            "global_step": state.global_step,
+            "seconds": round(elapsed, 1),
+            "samples_per_sec": round((self.collator.samples_seen - self.run_samples) / elapsed, 3),
+            "tokens_per_sec": round((self.collator.tokens_seen - self.run_tokens) / elapsed, 1),
+            "peak_memory_gb": round(torch.cuda.max_memory_allocated() / 1e9, 3) if torch.cuda.is_available() else 0,
+        }
+        with open(self.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Throughput ({'packed' if PACK_SEQUENCES else 'unpacked'}): "
+              f"{summary['tokens_per_sec']} training tokens/sec, {summary['samples_per_sec']} samples/sec over {summary['seconds']:.0f}s")
+
+
+class PreemptionCallback(TrainerCallback):
+    """Checkpoint and stop at the end of the current step when the machine is being preempted (SIGTERM)"""
+
+    def __init__(self):
+        self.preempted = False
+        signal.signal(signal.SIGTERM, self._handle)
+
+    def _handle(self, signum, frame):
+        print("SIGTERM received, saving a checkpoint after this step...")
+        self.preempted = True
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.preempted:
+            control.should_save = True
+            control.should_training_stop = True
+
+
+def latest_checkpoint(output_dir):
+    """Return the newest complete checkpoint in output_dir, or None.
+
+    trainer_state.json is written last, so a checkpoint interrupted while saving
+    is skipped in favour of the one before it.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    checkpoints = []
+    for name in os.listdir(output_dir):
+        match = re.fullmatch(r"checkpoint-(\d+)", name)
+        path = os.path.join(output_dir, name)
+        if match and os.path.isfile(os.path.join(path, "trainer_state.json")):
+            checkpoints.append((int(match.group(1)), path))
+    return max(checkpoints)[1] if checkpoints else None
+
+
+# Written to the output directory so a rerun only resumes the run it belongs to
+RUN_CONFIG_FILE = "run_config.json"
+
+
+def run_config():
+    """Settings that must match for a checkpoint to be resumed"""
+    return {
+        "model": model_name,
+        "lora_r": LORA_R,
+        "lora_alpha": peft_config.lora_alpha,
+        "lora_dropout": peft_config.lora_dropout,
+        "lora_target_modules": sorted(LORA_TARGET_MODULES),
+        "max_seq_length": MAX_SEQ_LENGTH,
+        "packed": PACK_SEQUENCES,
+        "num_train_epochs": training_arguments.num_train_epochs,
+        "data": train_data_key,
+    }
+
+
+def write_run_config(output_dir, config, finished=False):
+    with open(os.path.join(output_dir, RUN_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(dict(config, finished=finished), f, indent=2)
+
+
+def checkpoint_to_resume(output_dir, config):
+    """Return the checkpoint this run should resume from, or None to start fresh.
+
+    Exits instead of resuming a checkpoint from another configuration or data
+    set (its LoRA shapes may not even load), from a run without a recorded
+    configuration, or from a run that already finished.
+    """
+    checkpoint = latest_checkpoint(output_dir)
+    if checkpoint is None:
+        return None
+    
+    fresh_dir = "Set TRAIN_OUTPUT_DIR to a new directory to train from scratch."
+    try:
+        with open(os.path.join(output_dir, RUN_CONFIG_FILE), "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        raise SystemExit(f"{output_dir} holds checkpoints from a run without {RUN_CONFIG_FILE}, so it cannot be resumed safely. {fresh_dir}")
+    
+    changed = sorted(key for key in set(saved) | set(config) if key != "finished" and saved.get(key) != config.get(key))
+    if changed:
+        raise SystemExit(f"{output_dir} was trained with a different {', '.join(changed)}. {fresh_dir}")
+    
+    with open(os.path.join(checkpoint, "trainer_state.json"), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if saved.get("finished") or (state.get("max_steps") and state.get("global_step", 0) >= state["max_steps"]):
+        raise SystemExit(f"The run in {output_dir} already finished at {checkpoint}. {fresh_dir}")
+    return checkpoint
+
+
+collator = PackedCollator(tokenizer.pad_token_id, model.get_input_embeddings().weight.dtype)
+preemption = PreemptionCallback()
+os.makedirs(training_arguments.output_dir, exist_ok=True)
+
+trainer = Trainer(
     model=model,
     train_dataset=dataset,
-    peft_config=peft_config,
     args=training_arguments,
-    formatting_func=formatting_func,
+    data_collator=collator,
+    callbacks=[ThroughputCallback(collator, training_arguments.output_dir), preemption],
 )
 
-print("Starting quantized training...")
-trainer.train()
+# Resuming restores the adapter weights, optimizer, scheduler and RNG state and skips the batches already seen
+config = run_config()
+resume_from = checkpoint_to_resume(training_arguments.output_dir, config)
+if resume_from:
+    print(f"Resuming quantized training from {resume_from}...")
+else:
+    write_run_config(training_arguments.output_dir, config)
+    print("Starting quantized training...")
+trainer.train(resume_from_checkpoint=resume_from)
+
+if preemption.preempted:
+    print("Training interrupted; rerun the script to resume from the last checkpoint.")
+    raise SystemExit(0)
+write_run_config(training_arguments.output_dir, config, finished=True)
 
 # Save the fine-tuned model (adapter weights only)
 print("Saving model...")